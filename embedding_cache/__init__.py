@@ -0,0 +1,26 @@
+"""
+Caché persistente en disco de embeddings, indexada por (modelo de embeddings,
+hash del texto).
+
+Los vectores se guardan como filas float32 en un fichero que se lee con
+memmap, junto a un índice de texto plano con el hash del texto de cada fila.
+Cualquier función de embeddings del proyecto se puede envolver para que solo
+lleguen a la API los textos que no se han visto nunca:
+
+```python
+cache = EmbeddingCache("./embeddingcache", "text-embedding-ada-002")
+
+# estilo chromadb: `fn(input: list[str]) -> list[list[float]]`
+embedding_function = CachedEmbeddingFunction(
+    ef.OpenAIEmbeddingFunction(...), cache
+)
+
+# estilo langchain: `embed_documents` / `embed_query`
+embedding = CachedEmbeddings(OpenAIEmbeddings(), cache)
+```
+"""
+
+from .store import EmbeddingCache
+from .wrappers import CachedEmbeddingFunction, CachedEmbeddings
+
+__all__ = ["EmbeddingCache", "CachedEmbeddingFunction", "CachedEmbeddings"]
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: sin `flock` solo se serializan las escrituras del propio proceso
+    fcntl = None
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Almacén de embeddings de un único modelo al que solo se añaden filas.
+
+    Estructura de `<path>/<modelo>/`:
+
+    - `vectors.f32`: filas float32, una por texto cacheado
+    - `keys.txt`: el sha256 del texto de cada fila, en el mismo orden
+    - `meta.json`: la dimensión de los vectores
+    - `.lock`: fichero para el `flock` que serializa las escrituras entre
+      procesos (rag.py, v1 y v2 comparten la caché). En Windows no hay
+      `flock` y no se bloquea entre procesos
+
+    La fila de cada clave es su posición en `keys.txt`. Los vectores se
+    escriben antes que las claves, así que un proceso que muere entre las dos
+    escrituras deja filas sin clave al final de `vectors.f32` (o una clave a
+    medias): al abrir y antes de cada escritura se recortan ambos ficheros
+    para que tengan el mismo número de filas.
+    """
+
+    def __init__(self, path: str, model: str):
+        self.model = model
+        self.dir = os.path.join(path, re.sub(r"[^\w.-]", "_", model))
+        self.vectors_path = os.path.join(self.dir, "vectors.f32")
+        self.keys_path = os.path.join(self.dir, "keys.txt")
+        self.meta_path = os.path.join(self.dir, "meta.json")
+        self.lock_path = os.path.join(self.dir, ".lock")
+        self.lock = threading.Lock()
+        self.dim = None
+        self.rows: dict[str, int] = {}
+        # Filas de `keys.txt` (puede haber claves repetidas de versiones
+        # anteriores sin `flock`: la fila es la posición, no `len(self.rows)`)
+        self.n_rows = 0
+        self._keys_offset = 0
+        self._vectors = None
+        os.makedirs(self.dir, exist_ok=True)
+        with self.lock, self._file_lock():
+            self._refresh()
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """
+        Lee las claves que otros procesos hayan añadido desde la última
+        lectura y deja `keys.txt` y `vectors.f32` alineados. Se llama con el
+        `flock` cogido.
+        """
+        if self.dim is None and os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.dim = json.load(f)["dim"]
+        if not os.path.exists(self.keys_path):
+            open(self.keys_path, "a").close()
+
+        with open(self.keys_path, "rb+") as f:
+            f.seek(self._keys_offset)
+            data = f.read()
+            # Una clave a medias (sin salto de línea) no cuenta
+            complete = data.rfind(b"\n") + 1
+            if complete < len(data):
+                f.truncate(self._keys_offset + complete)
+            for key in data[:complete].decode().split():
+                self.rows.setdefault(key, self.n_rows)
+                self.n_rows += 1
+            self._keys_offset += complete
+
+        if self.dim is None:
+            return
+        row_bytes = self.dim * 4
+        size = 0
+        if os.path.exists(self.vectors_path):
+            size = os.path.getsize(self.vectors_path)
+        n_vectors = size // row_bytes
+        if n_vectors < self.n_rows:
+            # Claves sin vector: no debería pasar (se escriben después), pero
+            # si el fichero se ha dañado preferimos perder esas filas
+            self._truncate_keys(n_vectors)
+        if size != self.n_rows * row_bytes:
+            with open(self.vectors_path, "ab") as f:
+                f.truncate(self.n_rows * row_bytes)
+
+    def _truncate_keys(self, n_rows: int):
+        with open(self.keys_path, "rb") as f:
+            keys = f.read().decode().split()[:n_rows]
+        with open(self.keys_path, "w") as f:
+            f.write("".join(f"{key}\n" for key in keys))
+        self.rows, self.n_rows = {}, 0
+        for key in keys:
+            self.rows.setdefault(key, self.n_rows)
+            self.n_rows += 1
+        self._keys_offset = os.path.getsize(self.keys_path)
+        self._vectors = None
+
+    def _mmap(self) -> np.ndarray:
+        # Solo se vuelve a mapear si se han añadido filas desde la última lectura
+        if self._vectors is None or len(self._vectors) < self.n_rows:
+            self._vectors = np.memmap(
+                self.vectors_path,
+                dtype=np.float32,
+                mode="r",
+                shape=(self.n_rows, self.dim),
+            )
+        return self._vectors
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        with self.lock:
+            rows = [self.rows.get(text_hash(text)) for text in texts]
+            if not self.rows:
+                return [None] * len(texts)
+            vectors = self._mmap()
+            return [None if row is None else np.array(vectors[row]) for row in rows]
+
+    def put_many(self, texts: list[str], vectors) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self.lock, self._file_lock():
+            # Otro proceso puede haber añadido filas (o fijado la dimensión)
+            self._refresh()
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                with open(self.meta_path, "w") as f:
+                    json.dump({"model": self.model, "dim": self.dim}, f)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(
+                    f"Se esperaban vectores de dimensión {self.dim}, "
+                    f"no {vectors.shape[1]}"
+                )
+
+            new = {}
+            for text, vector in zip(texts, vectors):
+                key = text_hash(text)
+                if key not in self.rows and key not in new:
+                    new[key] = vector
+            if not new:
+                return
+
+            with open(self.vectors_path, "ab") as f:
+                f.write(np.stack(list(new.values())).tobytes())
+            with open(self.keys_path, "a") as f:
+                f.write("".join(f"{key}\n" for key in new))
+            for key in new:
+                self.rows[key] = self.n_rows
+                self.n_rows += 1
+            self._keys_offset = os.path.getsize(self.keys_path)
@@ -0,0 +1,64 @@
+from typing import Callable
+
+import numpy as np
+
+from .store import EmbeddingCache
+
+
+def embed_with_cache(
+    embed: Callable[[list[str]], list[list[float]]],
+    cache: EmbeddingCache,
+    texts: list[str],
+) -> list[list[float]]:
+    """
+    Devuelve los embeddings de `texts` llamando a `embed` una sola vez y solo
+    con los textos que no están en la caché (sin duplicados).
+    """
+    cached = cache.get_many(texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, cached) if v is None))
+    if missing:
+        vectors = embed(missing)
+        cache.put_many(missing, vectors)
+        fresh = dict(zip(missing, vectors))
+        cached = [fresh[t] if v is None else v for t, v in zip(texts, cached)]
+    return [np.asarray(vector, dtype=np.float32).tolist() for vector in cached]
+
+
+class CachedEmbeddingFunction:
+    """
+    Envuelve una función de embeddings de chromadb (`fn(input) -> embeddings`).
+    """
+
+    def __init__(self, embedding_function, cache: EmbeddingCache):
+        self.embedding_function = embedding_function
+        self.cache = cache
+
+    def __call__(self, input: list[str]) -> list[list[float]]:
+        return embed_with_cache(self.embedding_function, self.cache, list(input))
+
+    def __getattr__(self, name):
+        # `copy` y `pickle` crean el objeto sin `__init__` y buscan
+        # `__setstate__` antes de restaurar sus atributos: sin
+        # `embedding_function` todavía, leerla volvería a llamar a
+        # `__getattr__` sin fin
+        if name == "embedding_function":
+            raise AttributeError(name)
+        # `name()`, `get_config()`, etc. de la función de embeddings envuelta
+        return getattr(self.embedding_function, name)
+
+
+class CachedEmbeddings:
+    """
+    Envuelve un objeto `Embeddings` de langchain (`embed_documents` /
+    `embed_query`).
+    """
+
+    def __init__(self, embeddings, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return embed_with_cache(self.embeddings.embed_documents, self.cache, texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return embed_with_cache(self.embeddings.embed_documents, self.cache, [text])[0]
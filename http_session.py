@@ -0,0 +1,26 @@
+"""
+Sesión HTTP compartida por los ejemplos que descargan muchas páginas
+(`solved/rag/v2.py` y `solved/extractor/bulk.py`).
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def make_session(pool_size: int = 16) -> requests.Session:
+    """
+    Sesión con un pool de conexiones keep-alive compartido por todos los hilos
+    y reintentos para errores transitorios.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+        max_retries=Retry(
+            total=3, backoff_factor=0.5, status_forcelist=[429, 502, 503, 504]
+        ),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
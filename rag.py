@@ -16,8 +16,12 @@ Sugerencias:
 La solución está en el módulo `solved`
 """
 
+import json
 import sys
+import time
 import warnings
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 from langchain_core.runnables import RunnablePassthrough
@@ -30,6 +34,8 @@ from langchain_openai import ChatOpenAI
 import bs4
 import dotenv
 
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
 warnings.filterwarnings("ignore", message="API key must be provided")
 
 dotenv.load_dotenv()
@@ -50,8 +56,11 @@ docs = loader.load()
 text_splitter = RecursiveCharacterTextSplitter(
     chunk_size=1000, chunk_overlap=200)
 splits = text_splitter.split_documents(docs)
+embeddings = OpenAIEmbeddings()
 vectorstore = Chroma.from_documents(
-    documents=splits, embedding=OpenAIEmbeddings())
+    documents=splits,
+    embedding=CachedEmbeddings(
+        embeddings, EmbeddingCache("./embeddingcache", embeddings.model)))
 
 # Retrieve and generate using the relevant snippets of the blog.
 retriever = vectorstore.as_retriever()
@@ -70,7 +79,53 @@ rag_chain = (
 )
 
 
+# Batch mode: embed all the questions at once and run the generations in
+# parallel, keeping the input order.
+generate_chain = prompt | llm | StrOutputParser()
+
+
+def read_questions(source):
+    lines = (line.strip() for line in source)
+    return [
+        json.loads(line)["question"] if line.startswith("{") else line
+        for line in lines
+        if line
+    ]
+
+
+def answer_batch(questions, max_workers=8):
+    start = time.perf_counter()
+    vectors = vectorstore.embeddings.embed_documents(questions)
+    contexts = [
+        format_docs(vectorstore.similarity_search_by_vector(v)) for v in vectors]
+    retrieval = time.perf_counter() - start
+
+    def answer(item):
+        question, context = item
+        start = time.perf_counter()
+        result = {"question": question}
+        try:
+            result["answer"] = generate_chain.invoke(
+                {"context": context, "question": question})
+        except Exception as e:
+            result["error"] = repr(e)
+        result["timings"] = {
+            "retrieval": retrieval, "generation": time.perf_counter() - start}
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        yield from pool.map(answer, zip(questions, contexts))
+
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["--batch"]:
+        # python -m rag --batch [questions.jsonl | -]
+        path = sys.argv[2] if len(sys.argv) > 2 else "-"
+        with nullcontext(sys.stdin) if path == "-" else open(path) as source:
+            for result in answer_batch(read_questions(source)):
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+        sys.exit()
+
     if len(sys.argv) > 1:
         question = sys.argv[1]
     else:
@@ -0,0 +1,70 @@
+"""
+Benchmarks del extractor. A diferencia de los de `solved/rag`, estos sí llaman
+a la API de OpenAI (necesitan `OPENAI_API_KEY`) sobre charlas reales de
+pretalx.
+
+```bash
+python -m solved.extractor.bench packing [n_docs] [evento]
+```
+"""
+
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from http_session import make_session
+from solved.extractor import v5
+from solved.extractor.bulk import load_document, pretalx_talks
+
+
+def reset_stats():
+    v5.usage_stats.clear()
+    v5.extraction_stats.clear()
+    # Sin la caché de validaciones, cada modo paga sus propias validaciones
+    v5.validation_cache.clear()
+
+
+def packing(n_docs: int = 40, event: str = "pycones-2024", max_workers: int = 4):
+    """
+    Compara un documento por llamada (`extractor` en paralelo) con varios
+    documentos por prompt (`extractor_batch`) con la misma concurrencia:
+    documentos por segundo, llamadas, tokens y documentos sin extraer.
+    """
+    session = make_session()
+    urls = list(islice(pretalx_talks(event, session), n_docs))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        docs = dict(zip(urls, pool.map(lambda url: load_document(url, session), urls)))
+
+    def report(name: str, fn):
+        reset_stats()
+        start = time.perf_counter()
+        results = fn()
+        elapsed = time.perf_counter() - start
+        usage = v5.usage_stats
+        failed = sum(result is None for result in results.values())
+        print(
+            f"{name:>8}: {len(docs) / elapsed:5.2f} docs/s, {usage['calls']} llamadas, "
+            f"{usage['input_tokens']} tokens de entrada, "
+            f"{usage['output_tokens']} de salida, {failed} fallidos"
+        )
+        print(f"{'':>8}  {dict(v5.extraction_stats)}")
+
+    def single():
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = pool.map(lambda doc: v5.extractor(v5.charla, doc), docs.values())
+            return dict(zip(docs, results))
+
+    report("single", single)
+    report(
+        "packed",
+        lambda: v5.extractor_batch(v5.charla, docs, max_workers=max_workers),
+    )
+
+
+if __name__ == "__main__":
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == "packing":
+        packing(*(int(arg) if arg.isdigit() else arg for arg in args))
+    else:
+        raise SystemExit(__doc__)
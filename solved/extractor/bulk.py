@@ -0,0 +1,167 @@
+"""
+Extracción masiva: descarga y extrae muchos documentos (por ejemplo todas las
+charlas de varias conferencias de pretalx) con `extractor` de v5.
+
+- Como mucho `max_workers` documentos en proceso a la vez
+- Cada resultado (o error definitivo) se añade a un JSONL en cuanto termina
+- Al relanzar se saltan los documentos que ya están en el JSONL, así un fallo
+  en el documento 4000 no obliga a repetir los 3999 anteriores
+
+```bash
+python -m solved.extractor.bulk salida.jsonl pretalx:pycones-2024 charla.ics https://...
+```
+"""
+
+import json
+import os
+import sys
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Generator, Iterable
+
+import requests
+
+from http_session import make_session
+from solved.extractor.v5 import Model, charla, extractor
+
+PRETALX = "https://pretalx.com"
+
+
+def pretalx_talks(event: str, session: requests.Session) -> Generator[str, None, None]:
+    """
+    URLs `.ics` de todas las charlas publicadas de un evento de pretalx.
+    """
+    url = f"{PRETALX}/api/events/{event}/talks/"
+    while url:
+        response = session.get(url, timeout=30)
+        response.raise_for_status()
+        page = response.json()
+        for talk in page["results"]:
+            yield f"{PRETALX}/{event}/talk/{talk['code']}.ics"
+        url = page["next"]
+
+
+def expand_sources(
+    sources: Iterable[str], session: requests.Session
+) -> Generator[str, None, None]:
+    """
+    Cada fuente es una URL, una ruta a un fichero o `pretalx:<evento>` (todas
+    las charlas del evento).
+    """
+    for source in sources:
+        if source.startswith("pretalx:"):
+            yield from pretalx_talks(source.removeprefix("pretalx:"), session)
+        else:
+            yield source
+
+
+def load_document(source: str, session: requests.Session) -> str:
+    if source.startswith(("http://", "https://")):
+        response = session.get(source, timeout=30)
+        response.raise_for_status()
+        return response.text
+    with open(source) as f:
+        return f.read()
+
+
+def done_sources(path: str, retry_failed: bool = False) -> set[str]:
+    """
+    Fuentes ya procesadas en un JSONL anterior. Se ignoran las líneas
+    incompletas (el proceso murió a mitad de escritura) y las que no son un
+    resultado (sin `source`).
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(record, dict) or "source" not in record:
+                continue
+            if not (retry_failed and "error" in record):
+                done.add(record["source"])
+    return done
+
+
+def extract_source(model: Model, source: str, session: requests.Session) -> dict:
+    record = {"source": source}
+    try:
+        result = extractor(model, load_document(source, session))
+    except Exception as e:
+        record["error"] = repr(e)
+    else:
+        if result is None:
+            record["error"] = "La extracción no ha superado la validación"
+        else:
+            record["result"] = result
+    return record
+
+
+def bulk_extract(
+    sources: Iterable[str],
+    output: str,
+    model: Model = charla,
+    max_workers: int = 8,
+    retry_failed: bool = False,
+) -> Counter:
+    """
+    Extrae todas las fuentes que no estén ya en `output` y añade cada resultado
+    al JSONL según termina (en orden de finalización, no de entrada).
+
+    Con `retry_failed=True` se repiten las fuentes que terminaron con error.
+    """
+    session = make_session(max_workers)
+    done = done_sources(output, retry_failed)
+    stats = Counter(skipped=0, ok=0, error=0)
+
+    # Truncamos una posible línea a medias para que la siguiente empiece limpia
+    if os.path.exists(output):
+        with open(output, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                f.truncate(data.rfind(b"\n") + 1)
+
+    pending = iter(expand_sources(sources, session))
+    with open(output, "a") as out, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        running = set()
+        while True:
+            # Como mucho 2 * max_workers fuentes en vuelo: no se descargan
+            # listados enteros de charlas en memoria antes de empezar
+            for source in pending:
+                if source in done:
+                    stats["skipped"] += 1
+                    continue
+                done.add(source)
+                running.add(pool.submit(extract_source, model, source, session))
+                if len(running) >= 2 * max_workers:
+                    break
+            if not running:
+                break
+            finished, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                stats["error" if "error" in record else "ok"] += 1
+                print(
+                    f"{'ERROR' if 'error' in record else 'OK':>5} {record['source']}",
+                    file=sys.stderr,
+                )
+    return stats
+
+
+if __name__ == "__main__":
+    # python -m solved.extractor.bulk salida.jsonl [--retry-failed] fuente ... | -
+    args = [arg for arg in sys.argv[1:] if arg != "--retry-failed"]
+    output, sources = args[0], args[1:]
+    if sources in ([], ["-"]):
+        sources = (line.strip() for line in sys.stdin if line.strip())
+    stats = bulk_extract(sources, output, retry_failed="--retry-failed" in sys.argv)
+    print(
+        f"{stats['ok']} extraídos, {stats['error']} con error, "
+        f"{stats['skipped']} ya procesados",
+        file=sys.stderr,
+    )
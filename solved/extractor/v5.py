@@ -4,13 +4,42 @@ v5: Validación del campo `technologies`.
 Ahora utilizaremos una LLM para validar el campo `technologies` con criterios
 que requieres procesar lenguaje natural y razonar sobre el contenido (ver
 `validate_techs`).
+
+Extra:
+- Los validadores se ejecutan en paralelo y su resultado se memoiza por
+  (validador, valor normalizado): en los reintentos no se vuelve a llamar a la
+  LLM para validar un `technologies` que no ha cambiado
+- En los reintentos solo se piden los campos que han fallado, con sus errores
+  y las líneas del documento relacionadas (`repair_fields_prompt`), y se
+  combinan con los campos que ya eran válidos
+- Modo streaming (`stream=True`): el JSON se parsea según llegan los tokens
+  (`JsonFieldParser`), cada campo se valida en cuanto se cierra su valor y si
+  alguno no es válido se corta la generación para pasar antes a la reparación
+- Cada `Field` declara su JSON Schema y el `Model` se compila a un esquema
+  completo (`Model.json_schema`) que se envía como `response_format` con
+  `structured=True`. Del mismo esquema salen validadores estructurales en
+  Python (`schema_errors`) que no llaman a la LLM: los reintentos quedan para
+  los errores semánticos. Las claves que sobran se quitan sin reintentar
+  (`drop_extra_keys`). `extraction_stats` cuenta intentos, reintentos,
+  reintentos evitados y errores estructurales/semánticos
+- Documentos largos (más de `chunk_chars`): se trocean, cada trozo se extrae
+  en paralelo y los resultados parciales se combinan campo a campo con la
+  estrategia declarada en `Field.merge` (`most_common`, `union`, `dedupe_by`)
+- Documentos cortos (`extractor_batch`): se empaquetan varios en un mismo
+  prompt, sin pasar de `token_budget`, y la respuesta es un objeto JSON por
+  documento. Solo los que no pasan la validación se reparan por separado.
+  Ver `python -m solved.extractor.bench packing`
 """
 
 import json
 import re
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pprint import pprint
-from typing import Callable
+from typing import Callable, Generator
 
 from dotenv import load_dotenv
 from openai import OpenAI
@@ -19,14 +48,92 @@ from requests import get
 load_dotenv()
 client = OpenAI()
 
+# Llamadas y tokens de entrada/salida de todas las llamadas a la LLM
+usage_stats = Counter()
+usage_lock = threading.Lock()
+
+
+def record_usage(usage):
+    if usage is None:
+        return
+    with usage_lock:
+        usage_stats["calls"] += 1
+        usage_stats["input_tokens"] += usage.prompt_tokens
+        usage_stats["output_tokens"] += usage.completion_tokens
 
-def llm(prompt: str, model: str = "gpt-4o-mini") -> str:
+
+def llm(
+    prompt: str, model: str = "gpt-4o-mini", response_format: dict | None = None
+) -> str:
+    kwargs = {"response_format": response_format} if response_format else {}
     response = client.chat.completions.create(
-        model=model, messages=[{"role": "user", "content": prompt}]
+        model=model, messages=[{"role": "user", "content": prompt}], **kwargs
     )
+    record_usage(response.usage)
     return response.choices[0].message.content
 
 
+def llm_stream(
+    prompt: str, model: str = "gpt-4o-mini", response_format: dict | None = None
+) -> Generator[str, None, None]:
+    kwargs = {"response_format": response_format} if response_format else {}
+    stream = client.chat.completions.create(
+        model=model,
+        messages=[{"role": "user", "content": prompt}],
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs,
+    )
+    try:
+        for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+            record_usage(event.usage)
+    finally:
+        stream.close()
+
+
+def normalize_value(value: any) -> str:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False)
+
+
+def most_common(values: list[any]) -> any:
+    """
+    El valor que más trozos han extraído (en caso de empate, el primero).
+    """
+    counts = Counter(normalize_value(value) for value in values)
+    return max(values, key=lambda value: counts[normalize_value(value)])
+
+
+def union(values: list[list[any]]) -> list[any]:
+    """
+    Unión de listas sin duplicados (sin distinguir mayúsculas), en orden de
+    aparición.
+    """
+    merged = {}
+    for value in values:
+        for item in value if isinstance(value, list) else [value]:
+            merged.setdefault(normalize_value(item).lower(), item)
+    return list(merged.values())
+
+
+def dedupe_by(key: str) -> Callable[[list[list[dict]]], list[dict]]:
+    """
+    Unión de listas de objetos sin repetir `key` (por ejemplo la URL de los
+    enlaces). Se queda con el primero.
+    """
+
+    def merge(values: list[list[dict]]) -> list[dict]:
+        merged = {}
+        for value in values:
+            for item in value if isinstance(value, list) else [value]:
+                id = item.get(key) if isinstance(item, dict) else item
+                merged.setdefault(normalize_value(id), item)
+        return list(merged.values())
+
+    return merge
+
+
 @dataclass
 class Field:
     """
@@ -34,19 +141,151 @@ class Field:
 
     `validator` es una función que valida el campo y lanza una excepción si no
     es válido.
+
+    `schema` es el JSON Schema del valor (por defecto, un texto). La estructura
+    se valida con él antes de ejecutar `validator`.
+
+    `merge` combina los valores extraídos de los trozos de un documento largo.
     """
 
     name: str
     description: str
     validator: Callable[[any], None] = lambda _: None
+    schema: dict | None = None
+    merge: Callable[[list[any]], any] = most_common
 
     def __str__(self) -> str:
         return f"'{self.name}': '{self.description}'"
 
+    @property
+    def json_schema(self) -> dict:
+        return {**(self.schema or {"type": "string"}), "description": self.description}
+
+
+# Palabras clave que validamos en Python pero que el modo estricto de
+# structured outputs no admite
+UNSUPPORTED_KEYWORDS = {"minLength", "minItems"}
+
+
+def strip_unsupported(schema):
+    if isinstance(schema, dict):
+        return {
+            key: strip_unsupported(value)
+            for key, value in schema.items()
+            if key not in UNSUPPORTED_KEYWORDS
+        }
+    if isinstance(schema, list):
+        return [strip_unsupported(value) for value in schema]
+    return schema
+
 
 @dataclass
 class Model:
     fields: list[Field]
+    name: str = "extraction"
+
+    def json_schema(self, names: set[str] | None = None) -> dict:
+        """
+        Esquema del objeto con todos los campos (o solo `names`, para las
+        reparaciones). Todos son obligatorios y no se admiten otros, como
+        exige el modo estricto.
+        """
+        fields = [f for f in self.fields if names is None or f.name in names]
+        return {
+            "type": "object",
+            "properties": {f.name: f.json_schema for f in fields},
+            "required": [f.name for f in fields],
+            "additionalProperties": False,
+        }
+
+    def response_format(self, names: set[str] | None = None) -> dict:
+        return {
+            "type": "json_schema",
+            "json_schema": {
+                "name": self.name,
+                "schema": strip_unsupported(self.json_schema(names)),
+                "strict": True,
+            },
+        }
+
+
+JSON_TYPES = {
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+    "null": type(None),
+}
+
+
+def schema_errors(value: any, schema: dict, path: str = "") -> list[str]:
+    """
+    Validador estructural generado a partir del JSON Schema (el subconjunto
+    que usamos: `type`, `properties`, `required`, `items`, `minLength` y
+    `minItems`). No llama a la LLM.
+
+    `additionalProperties: False` solo lo impone `response_format`: aquí las
+    claves que sobran no son un error (`drop_extra_keys` las quita), igual que
+    no lo eran para el `validate_links` de v4.
+    """
+    where = f" en `{path}`" if path else ""
+    types = schema.get("type")
+    if types is not None:
+        types = [types] if isinstance(types, str) else types
+        # `bool` es subclase de `int` en Python pero no en JSON
+        if isinstance(value, bool) and "boolean" not in types:
+            return [f"Se esperaba {' o '.join(types)}{where}"]
+        if not isinstance(value, tuple(JSON_TYPES[t] for t in types)):
+            return [f"Se esperaba {' o '.join(types)}{where}, no {value!r}"]
+
+    errors = []
+    if isinstance(value, str) and len(value) < schema.get("minLength", 0):
+        errors.append(f"El texto no puede estar vacío{where}")
+    if isinstance(value, list):
+        if len(value) < schema.get("minItems", 0):
+            errors.append(f"Se esperaban al menos {schema['minItems']} elementos{where}")
+        if "items" in schema:
+            for i, item in enumerate(value):
+                errors += schema_errors(item, schema["items"], f"{path}[{i}]")
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        for name in schema.get("required", []):
+            if name not in value:
+                errors.append(f"Falta `{name}`{where}: {value}")
+        for name, item in value.items():
+            if name in properties:
+                errors += schema_errors(item, properties[name], f"{path}.{name}")
+    return errors
+
+
+def drop_extra_keys(value: any, schema: dict) -> tuple[any, int]:
+    """
+    Quita de los objetos las claves que el esquema no admite
+    (`additionalProperties: False`). Devuelve el valor y cuántas ha quitado.
+    """
+    dropped = 0
+    if isinstance(value, list) and "items" in schema:
+        items = []
+        for item in value:
+            item, n = drop_extra_keys(item, schema["items"])
+            items.append(item)
+            dropped += n
+        return items, dropped
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        result = {}
+        for name, item in value.items():
+            if name in properties:
+                result[name], n = drop_extra_keys(item, properties[name])
+                dropped += n
+            elif schema.get("additionalProperties") is False:
+                dropped += 1
+            else:
+                result[name] = item
+        return result, dropped
+    return value, 0
 
 
 def extract_fields_prompt(model: Model, doc: str) -> dict[str, any]:
@@ -71,6 +310,123 @@ Campos a extraer: {model.fields}.
 """
 
 
+def extract_chunk_prompt(model: Model, chunk: str, i: int, n_chunks: int) -> str:
+    return f"""Eres un experto extractor de información. De pequeño soñaste con
+este trabajo. Ahora puedes hacerlo realidad. De ello depende el futuro de
+la humanidad. Además si lo haces bien tendrás una propina de 100k€.
+
+# Documento (fragmento {i + 1} de {n_chunks})
+
+{chunk}
+
+
+# Campos
+
+Campos a extraer: {model.fields}.
+
+Extrae solo lo que aparece en este fragmento. Si un campo no aparece, déjalo
+vacío ("" o []).
+
+```json
+"""
+
+
+def extract_packed_prompt(model: Model, docs: dict[str, str]) -> str:
+    sections = "\n\n".join(f"## Documento `{id}`\n\n{doc}" for id, doc in docs.items())
+    return f"""Eres un experto extractor de información. De pequeño soñaste con
+este trabajo. Ahora puedes hacerlo realidad. De ello depende el futuro de
+la humanidad. Además si lo haces bien tendrás una propina de 100k€.
+
+# Documentos
+
+{sections}
+
+
+# Campos
+
+Campos a extraer de cada documento: {model.fields}.
+
+Devuelve un objeto JSON con una clave por documento (su identificador entre
+comillas invertidas) cuyo valor son los campos extraídos de ese documento.
+
+```json
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Aproximación barata: ~4 caracteres por token.
+    """
+    return len(text) // 4 + 1
+
+
+def pack_documents(
+    model: Model, docs: dict[str, str], token_budget: int = 4000, max_docs: int = 20
+) -> list[dict[str, str]]:
+    """
+    Agrupa los documentos en paquetes cuyo prompt no pasa de `token_budget`
+    tokens (estimados) ni de `max_docs` documentos (la salida también crece
+    con cada documento). Un documento que no cabe solo va en su propio
+    paquete.
+    """
+    overhead = estimate_tokens(extract_packed_prompt(model, {}))
+    packs, pack, size = [], {}, overhead
+    for id, doc in docs.items():
+        tokens = estimate_tokens(doc) + 10
+        if pack and (size + tokens > token_budget or len(pack) >= max_docs):
+            packs.append(pack)
+            pack, size = {}, overhead
+        pack[id] = doc
+        size += tokens
+    if pack:
+        packs.append(pack)
+    return packs
+
+
+def split_line(line: str, max_chars: int) -> list[str]:
+    """
+    Parte una línea más larga que `max_chars` en trozos, por un espacio si lo
+    hay en la segunda mitad de la ventana (para no cortar palabras).
+    """
+    pieces = []
+    while len(line) > max_chars:
+        cut = line.rfind(" ", max_chars // 2, max_chars)
+        cut = cut + 1 if cut != -1 else max_chars
+        pieces.append(line[:cut])
+        line = line[cut:]
+    return pieces + [line]
+
+
+def split_doc(doc: str, chunk_chars: int, overlap_chars: int = 200) -> list[str]:
+    """
+    Trozos de como mucho `chunk_chars` caracteres, cortando por líneas (y las
+    líneas más largas que un trozo, por espacios). El principio de cada trozo
+    repite las últimas líneas del anterior, como mucho `overlap_chars`
+    caracteres (y nunca más de un cuarto del trozo), para no cortar un dato
+    por la mitad sin que un trozo contenga entero al anterior.
+    """
+    overlap_chars = min(overlap_chars, chunk_chars // 4)
+    pieces = [
+        piece for line in doc.splitlines() for piece in split_line(line, chunk_chars)
+    ]
+    chunks, lines, size = [], [], 0
+    for piece in pieces:
+        if lines and size + len(piece) > chunk_chars:
+            chunks.append("\n".join(lines))
+            overlap, overlap_size = [], 0
+            for line in reversed(lines):
+                if overlap_size + len(line) + 1 > overlap_chars:
+                    break
+                overlap.insert(0, line)
+                overlap_size += len(line) + 1
+            lines, size = overlap, overlap_size
+        lines.append(piece)
+        size += len(piece) + 1
+    if lines:
+        chunks.append("\n".join(lines))
+    return chunks
+
+
 def fix_fields_prompt(
     model: Model,
     doc: str,
@@ -98,6 +454,74 @@ errores de extracción ocurridos en el siguiente documento:
 """
 
 
+WORD_RE = re.compile(r"\w{3,}")
+
+
+def relevant_context(doc: str, hints: list[str], max_chars: int = 2000) -> str:
+    """
+    Recorta el documento a las líneas que comparten más palabras con `hints`
+    (valores anteriores y descripciones de los campos a corregir), en el orden
+    original y sin pasar de `max_chars`.
+    """
+    if len(doc) <= max_chars:
+        return doc
+    words = {word.lower() for hint in hints for word in WORD_RE.findall(hint)}
+    lines = doc.splitlines()
+    scores = [
+        len(words & {word.lower() for word in WORD_RE.findall(line)}) for line in lines
+    ]
+    selected, size = set(), 0
+    for i in sorted(range(len(lines)), key=lambda i: -scores[i]):
+        if not scores[i] or size + len(lines[i]) > max_chars:
+            break
+        selected.add(i)
+        size += len(lines[i]) + 1
+    if not selected:
+        return doc[:max_chars]
+    return "\n".join(lines[i] for i in sorted(selected))
+
+
+def repair_fields_prompt(
+    model: Model,
+    doc: str,
+    parsed: dict[str, any],
+    validation_errors: list[tuple[str, str]],
+) -> str:
+    """
+    Prompt de reparación acotado a los campos con errores: mucho más corto que
+    `fix_fields_prompt` y la respuesta solo incluye esos campos.
+    """
+    fields = {field.name: field for field in model.fields}
+    failing = [fields[name] for name, _ in validation_errors if name in fields]
+    hints = [field.description for field in failing] + [
+        normalize_value(parsed.get(field.name)) for field in failing
+    ]
+    errors = "\n".join(
+        f"""- {fields[name]}
+  Valor anterior: {normalize_value(parsed.get(name))}
+  Error: {e}"""
+        for name, e in validation_errors
+        if name in fields
+    )
+    return f"""Eres un experto extractor de información. Algunos campos extraídos
+del siguiente documento no son válidos y tienes que corregirlos.
+
+# Fragmentos del documento
+
+{relevant_context(doc, hints)}
+
+# Campos a corregir
+
+{errors}
+
+Devuelve solo los campos corregidos.
+
+# Campos corregidos
+
+```json
+"""
+
+
 JSON_BLOCK_RE = re.compile(r"```json\s*([\s\S]*)\s*```")
 
 
@@ -111,10 +535,61 @@ def parse_json_block(output: str) -> dict[str, any]:
     """
     match = JSON_BLOCK_RE.search(output)
     if not match:
+        # Con `response_format` la salida es directamente el objeto JSON
+        if output.lstrip().startswith("{"):
+            return json.loads(output)
         raise ValueError("No se ha encontrado un bloque JSON")
     return json.loads(match.group(1))
 
 
+class ValidatorError(Exception):
+    """
+    El validador no ha podido decidir si el valor es válido (por ejemplo, la
+    LLM que valida ha devuelto algo que no se puede interpretar). A diferencia
+    de un `ValueError`, no es un veredicto sobre el valor y no se memoiza.
+    """
+
+
+# (validador, valor normalizado) -> mensaje de error o `None` si es válido
+validation_cache: dict[tuple[Callable, str], str | None] = {}
+validation_cache_lock = threading.Lock()
+
+
+def run_validator(field: Field, parsed: dict[str, any]) -> str | None:
+    """
+    Ejecuta el validador de un campo y devuelve el mensaje de error (o `None`).
+
+    Solo se memoizan los veredictos (valor válido o `ValueError`): un error de
+    red o una salida ilegible (`ValidatorError`, `JSONDecodeError`) de un
+    validador con LLM se reintenta.
+    """
+    if field.name not in parsed:
+        return f"No se ha extraído el campo `{field.name}`"
+    # La estructura se comprueba antes: no tiene sentido pagar una validación
+    # con LLM de un valor mal formado
+    structural = schema_errors(parsed[field.name], field.json_schema)
+    if structural:
+        return "; ".join(structural)
+    key = (field.validator, normalize_value(parsed[field.name]))
+    with validation_cache_lock:
+        if key in validation_cache:
+            return validation_cache[key]
+
+    try:
+        field.validator(parsed[field.name])
+        error = None
+    except json.JSONDecodeError as e:
+        return str(e)
+    except ValueError as e:
+        error = e.args[0]
+    except Exception as e:
+        return e.args[0] if e.args else repr(e)
+
+    with validation_cache_lock:
+        validation_cache[key] = error
+    return error
+
+
 def validate_output(
     output: str, model: Model
 ) -> tuple[dict[str, any], list[tuple[str, Exception]]]:
@@ -125,49 +600,349 @@ def validate_output(
     de validación si los hay.
     """
     parsed = parse_json_block(output)
-    validation_errors = []
+    return parsed, validate_fields(parsed, model)
+
+
+def validate_fields(parsed: dict[str, any], model: Model) -> list[tuple[str, str]]:
+    """
+    Ejecuta todos los validadores en paralelo: la latencia es la del validador
+    más lento y no la suma de todos.
 
+    Antes quita de `parsed` las claves que sobran según el esquema de cada
+    campo (`drop_extra_keys`). Si gracias a eso todo es válido, cuenta un
+    reintento evitado (`extraction_stats["retries_avoided"]`): con el esquema
+    estricto esa respuesta se habría vuelto a pedir.
+    """
+    if not isinstance(parsed, dict):
+        return [
+            (field.name, "La respuesta no es un objeto JSON con los campos")
+            for field in model.fields
+        ]
+    dropped = 0
     for field in model.fields:
+        if field.name in parsed:
+            parsed[field.name], n = drop_extra_keys(parsed[field.name], field.json_schema)
+            dropped += n
+    with ThreadPoolExecutor(max_workers=len(model.fields) or 1) as pool:
+        errors = pool.map(lambda field: run_validator(field, parsed), model.fields)
+        errors = [
+            (field.name, error)
+            for field, error in zip(model.fields, errors)
+            if error is not None
+        ]
+    if dropped and not errors:
+        extraction_stats["retries_avoided"] += 1
+    return errors
+
+
+class JsonFieldParser:
+    """
+    Parser incremental del primer objeto JSON de la salida: `feed` recibe
+    cada delta y devuelve los pares (campo, valor) de primer nivel que ya se
+    han cerrado. Se ignora lo que haya antes de la primera `{` (por ejemplo
+    la cabecera del bloque markdown).
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.member_start = 0
+        self.closed = False
+
+    def feed(self, delta: str) -> list[tuple[str, any]]:
+        self.text += delta
+        members = []
+        while self.pos < len(self.text) and not self.closed:
+            c = self.text[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif self.depth == 0:
+                if c == "{":
+                    self.depth = 1
+                    self.member_start = self.pos + 1
+            elif c == '"':
+                self.in_string = True
+            elif c in "{[":
+                self.depth += 1
+            elif c in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    members += self._member(self.pos)
+                    self.closed = True
+            elif c == "," and self.depth == 1:
+                members += self._member(self.pos)
+                self.member_start = self.pos + 1
+            self.pos += 1
+        return members
+
+    def _member(self, end: int) -> list[tuple[str, any]]:
+        segment = self.text[self.member_start : end].strip()
+        return list(json.loads("{" + segment + "}").items()) if segment else []
+
+
+stream_stats = Counter()
+extraction_stats = Counter()
+
+
+def stream_json_fields(
+    prompt: str, model: Model, response_format: dict | None = None
+) -> dict[str, any]:
+    """
+    Genera en streaming y valida cada campo de `model` en cuanto su valor
+    está completo. Con el primer error se corta la generación: devuelve los
+    campos recibidos hasta entonces y la reparación pedirá el resto.
+
+    Los validadores ya ejecutados quedan memoizados, así que el
+    `validate_fields` posterior no los repite.
+    """
+    fields = {field.name: field for field in model.fields}
+    parser, parsed, futures = JsonFieldParser(), {}, []
+    deltas = llm_stream(prompt, response_format=response_format)
+    pool = ThreadPoolExecutor(max_workers=len(fields) or 1)
+    try:
+        for delta in deltas:
+            for name, value in parser.feed(delta):
+                parsed[name] = value
+                if name in fields:
+                    futures.append(pool.submit(run_validator, fields[name], parsed))
+            if any(f.done() and f.result() is not None for f in futures):
+                stream_stats["cancelled"] += 1
+                return parsed
+            if parser.closed:
+                break
+    finally:
+        deltas.close()
+        # Al cortar no esperamos a los validadores pendientes: su resultado
+        # queda en la caché igualmente
+        pool.shutdown(wait=parser.closed)
+
+    if not parser.closed:
+        raise ValueError("No se ha encontrado un objeto JSON completo")
+    stream_stats["completed"] += 1
+    return parsed
+
+
+def map_reduce_extract(
+    model: Model,
+    doc: str,
+    chunk_chars: int,
+    max_workers: int = 8,
+    response_format: dict | None = None,
+) -> dict[str, any]:
+    """
+    Extrae cada trozo del documento en paralelo (map) y combina los valores
+    no vacíos de cada campo con `Field.merge` (reduce, determinista). Los
+    campos que no aparecen en ningún trozo se quedan sin extraer y los pide
+    la reparación.
+    """
+    chunks = split_doc(doc, chunk_chars)
+
+    def extract(item: tuple[int, str]) -> dict[str, any]:
+        i, chunk = item
         try:
-            field.validator(parsed[field.name])
-        except Exception as e:
-            validation_errors.append((field.name, e.args[0]))
+            output = llm(
+                extract_chunk_prompt(model, chunk, i, len(chunks)),
+                response_format=response_format,
+            )
+            return parse_json_block(output)
+        except ValueError:
+            # Un trozo mal extraído no invalida los demás
+            return {}
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(chunks))) as pool:
+        partials = list(pool.map(extract, enumerate(chunks)))
+    extraction_stats["chunks"] += len(chunks)
+
+    merged = {}
+    for field in model.fields:
+        values = [
+            partial[field.name]
+            for partial in partials
+            if partial.get(field.name) not in (None, "", [], {})
+        ]
+        if values:
+            merged[field.name] = field.merge(values)
+    return merged
+
 
-    return parsed, validation_errors
+def extractor(
+    model: Model,
+    doc: str,
+    max_retries: int = 3,
+    repair: str = "fields",
+    stream: bool = False,
+    structured: bool = False,
+    chunk_chars: int = 12_000,
+    initial: dict[str, any] | None = None,
+) -> dict[str, any] | None:
+    """
+    `repair` indica cómo se corrigen los errores de validación:
 
+    - `fields`: se piden solo los campos con errores y se combinan con los
+      anteriores
+    - `full`: se vuelve a pedir la extracción completa (`fix_fields_prompt`)
 
-def extractor(model: Model, doc: str, max_retries: int = 3) -> dict[str, any] | None:
-    parsed, validation_errors = None, []
+    Con `stream=True` cada respuesta se valida según llega
+    (`stream_json_fields`).
+
+    Con `structured=True` se envía el esquema del modelo (o de los campos a
+    reparar) como `response_format`: el proveedor garantiza la estructura y
+    los reintentos quedan para los errores semánticos. Sin `structured`, las
+    respuestas que solo fallan por claves de más se arreglan sin reintentar
+    (`extraction_stats["retries_avoided"]`).
+
+    Los documentos de más de `chunk_chars` caracteres se extraen por trozos
+    (`map_reduce_extract`) y siempre se reparan por campos, con un contexto
+    recortado que sí cabe en el prompt.
+
+    `initial` es una extracción previa (por ejemplo de `extractor_batch`): si
+    no es válida se empieza directamente por la reparación. Si una respuesta
+    (o `initial`) no es un objeto JSON, fallan todos los campos y se vuelve a
+    extraer el documento completo.
+    """
+    fields = {field.name: field for field in model.fields}
+    chunked = len(doc) > chunk_chars
+    if chunked:
+        repair = "fields"
+    parsed, validation_errors = initial, []
+    if initial is not None:
+        validation_errors = validate_fields(parsed, model)
+        if not validation_errors:
+            return parsed
     for _ in range(max_retries):
-        if validation_errors:
+        failing = None
+        if not isinstance(parsed, dict):
+            # Sin extracción previa o la respuesta no era un objeto JSON (por
+            # ejemplo un array): fallan todos los campos y se extrae de nuevo
+            prompt = None if chunked else extract_fields_prompt(model, doc)
+        elif repair == "fields":
+            prompt = repair_fields_prompt(model, doc, parsed, validation_errors)
+            failing = {name for name, _ in validation_errors}
+        else:
             prompt = fix_fields_prompt(model, doc, parsed, validation_errors)
+
+        response_format = model.response_format(failing) if structured else None
+        extraction_stats["attempts"] += 1
+        if parsed is not None:
+            extraction_stats["retries"] += 1
+        if prompt is None:
+            fixed = map_reduce_extract(
+                model, doc, chunk_chars, response_format=response_format
+            )
+        elif stream:
+            fixed = stream_json_fields(prompt, model, response_format)
+        else:
+            fixed = parse_json_block(llm(prompt, response_format=response_format))
+        if failing is None or not isinstance(fixed, dict):
+            parsed = fixed
         else:
-            prompt = extract_fields_prompt(model, doc)
+            parsed = {**parsed, **{k: v for k, v in fixed.items() if k in failing}}
+        validation_errors = validate_fields(parsed, model)
+        for name, _ in validation_errors:
+            field = fields.get(name)
+            if field is None or not isinstance(parsed, dict) or name not in parsed:
+                continue
+            if schema_errors(parsed[name], field.json_schema):
+                extraction_stats["structural_errors"] += 1
+            else:
+                extraction_stats["semantic_errors"] += 1
 
-        output = llm(prompt)
-        parsed, validation_errors = validate_output(output, model)
         if not validation_errors:
             return parsed
     return None
 
 
-def validate_links(links: list[dict[str, str]]) -> None:
-    for link in links:
-        if not isinstance(link, dict):
-            raise ValueError(
-                "Los enlaces deben ser un diccionario con la siguiente estructura: {{'url': str, 'description': str}}"
+def extractor_batch(
+    model: Model,
+    docs: dict[str, str],
+    token_budget: int = 4000,
+    max_docs: int = 20,
+    max_workers: int = 4,
+    structured: bool = False,
+    **kwargs,
+) -> dict[str, dict[str, any] | None]:
+    """
+    Extrae muchos documentos cortos empaquetando varios en cada prompt
+    (`pack_documents`): las instrucciones y la latencia de cada petición se
+    reparten entre todos. La respuesta se separa por identificador y cada
+    documento se valida por su cuenta; solo los que fallan (o faltan en la
+    respuesta) pasan por `extractor` para repararse de forma individual.
+
+    `kwargs` se pasa a `extractor` (`max_retries`, `repair`...).
+    """
+
+    def extract_pack(pack: dict[str, str]) -> dict[str, dict[str, any] | None]:
+        if len(pack) == 1:
+            [(id, doc)] = pack.items()
+            return {id: extractor(model, doc, structured=structured, **kwargs)}
+
+        response_format = None
+        if structured:
+            response_format = {
+                "type": "json_schema",
+                "json_schema": {
+                    "name": f"{model.name}_batch",
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            id: strip_unsupported(model.json_schema()) for id in pack
+                        },
+                        "required": list(pack),
+                        "additionalProperties": False,
+                    },
+                    "strict": True,
+                },
+            }
+        extraction_stats["packed_calls"] += 1
+        try:
+            output = llm(
+                extract_packed_prompt(model, pack), response_format=response_format
             )
-        if not link.get("url"):
-            raise ValueError(f"No se ha proporcionado un enlace (`url`) en {link}")
-        if not link.get("description"):
-            raise ValueError(
-                f"No se ha proporcionado una descripción (`description`) en {link}"
+            parsed = parse_json_block(output)
+        except ValueError:
+            parsed = {}
+        # Un array (u otra cosa) en vez de un objeto por documento: todos
+        # pasan a la extracción individual
+        if not isinstance(parsed, dict):
+            parsed = {}
+
+        def finish(id: str) -> dict[str, any] | None:
+            partial = parsed.get(id) or parsed.get(f"`{id}`")
+            if not isinstance(partial, dict):
+                partial = None
+            if partial is not None and not validate_fields(partial, model):
+                extraction_stats["packed_ok"] += 1
+                return partial
+            extraction_stats["packed_fallbacks"] += 1
+            return extractor(
+                model, pack[id], structured=structured, initial=partial, **kwargs
             )
 
+        # Cada documento se valida (y si hace falta se repara) a la vez que el
+        # resto: un paquete no espera a `n` validaciones con LLM seguidas
+        with ThreadPoolExecutor(max_workers=len(pack)) as pool:
+            return dict(zip(pack, pool.map(finish, pack)))
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for pack_results in pool.map(
+            extract_pack, pack_documents(model, docs, token_budget, max_docs)
+        ):
+            results.update(pack_results)
+    return results
+
 
 def validate_techs(techs: list[str]) -> None:
-    output = parse_json_block(
-        llm(f"""De la siguiente lista de etiquetas: {techs} verifica que se cumplen las siguientes condiciones:
+    output = llm(
+        f"""De la siguiente lista de etiquetas: {techs} verifica que se cumplen las siguientes condiciones:
 - Las siglas están descritas entre paréntesis, por ejemplo: `IPv6 (Internet Protocol Version 6)`
 - Están escritas en inglés
 
@@ -185,8 +960,13 @@ Si no hay errores devuelve una lista vacía.
 # Errores
 
 ```json
-[""")
+["""
     )
+    try:
+        output = parse_json_block(output)
+    except ValueError as e:
+        # Fallo de la LLM que valida, no del valor: no se memoiza
+        raise ValidatorError(f"No se ha podido interpretar la validación: {e}") from e
 
     if output:
         raise ValueError(output)
@@ -199,16 +979,40 @@ charla = Model(
         Field(
             name="links",
             description="Los enlaces mencionados en la charla",
-            validator=validate_links,
+            merge=dedupe_by("url"),
+            # Sustituye a `validate_links` de v4 (se comprueba con `schema_errors`)
+            schema={
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "url": {"type": "string", "minLength": 1},
+                        "description": {"type": "string", "minLength": 1},
+                    },
+                    "required": ["url", "description"],
+                    "additionalProperties": False,
+                },
+            },
         ),
         Field(
             name="technologies",
             description="Las tecnologías mencionadas en la charla",
             validator=validate_techs,
+            schema={"type": "array", "items": {"type": "string"}},
+            merge=union,
         ),
     ]
 )
 
 if __name__ == "__main__":
+    # python -m solved.extractor.v5 [--stream] [--structured]
     doc = get("https://pretalx.com/pycones-2024/talk/SKZFHY.ics").text
-    pprint(extractor(charla, doc))
+    pprint(
+        extractor(
+            charla,
+            doc,
+            stream="--stream" in sys.argv,
+            structured="--structured" in sys.argv,
+        )
+    )
+    print(dict(extraction_stats), file=sys.stderr)
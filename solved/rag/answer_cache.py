@@ -0,0 +1,120 @@
+"""
+Caché semántica de respuestas: si una pregunta nueva es suficientemente
+parecida (similitud coseno de sus embeddings >= `threshold`) a una ya
+respondida, se devuelve la respuesta guardada sin llamar a la LLM.
+
+- Expulsión LRU (`max_entries`) y por antigüedad (`ttl` en segundos)
+- Se vacía cuando cambia la revisión de la colección (ver `sync_db`), ya que
+  las respuestas guardadas podrían estar basadas en contexto desactualizado
+- Cada respuesta se guarda con un `scope` (por ejemplo la configuración de la
+  búsqueda que generó su contexto) y solo se reutiliza con el mismo `scope`
+- `stats` cuenta aciertos, fallos, expulsiones e invalidaciones
+"""
+
+import threading
+import time
+from collections import Counter, OrderedDict
+from itertools import count
+from typing import NamedTuple
+
+import numpy as np
+
+
+def normalize(embedding) -> np.ndarray:
+    embedding = np.asarray(embedding, dtype=np.float32)
+    return embedding / (np.linalg.norm(embedding) or 1)
+
+
+class Entry(NamedTuple):
+    question: str
+    answer: str
+    embedding: np.ndarray
+    created: float
+    scope: int
+
+
+class SemanticCache:
+    def __init__(
+        self, threshold: float = 0.95, max_entries: int = 1000, ttl: float = 24 * 3600
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict[int, Entry] = OrderedDict()
+        self.revision = None
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self._keys = count()
+        # Matriz de embeddings para buscar con un único producto matricial y
+        # claves de cada fila. Solo se reconstruye cuando se añaden o eliminan
+        # entradas (no al reordenar por LRU).
+        self._matrix = None
+        self._rows: list[int] = []
+        self._row_scopes = None
+        # `scope` -> entero, para comparar los de todas las filas con NumPy
+        self._scopes: dict = {}
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    def _check_revision(self, revision):
+        if revision != self.revision:
+            if self.entries:
+                self.stats["invalidations"] += 1
+            self.entries.clear()
+            self._matrix = None
+            self.revision = revision
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [k for k, e in self.entries.items() if now - e.created > self.ttl]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            self.stats["expired"] += len(expired)
+            self._matrix = None
+
+    def _scope_id(self, scope) -> int:
+        return self._scopes.setdefault(scope, len(self._scopes))
+
+    def lookup(self, embedding, revision=None, scope=None) -> str | None:
+        embedding = normalize(embedding)
+        with self.lock:
+            self._check_revision(revision)
+            self._expire()
+            if not self.entries:
+                self.stats["misses"] += 1
+                return None
+
+            if self._matrix is None:
+                self._rows = list(self.entries)
+                self._matrix = np.stack([e.embedding for e in self.entries.values()])
+                self._row_scopes = np.array([e.scope for e in self.entries.values()])
+            similarities = np.where(
+                self._row_scopes == self._scope_id(scope),
+                self._matrix @ embedding,
+                -np.inf,
+            )
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            key = self._rows[best]
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return self.entries[key].answer
+
+    def store(self, embedding, question: str, answer: str, revision=None, scope=None):
+        embedding = normalize(embedding)
+        with self.lock:
+            self._check_revision(revision)
+            self.entries[next(self._keys)] = Entry(
+                question, answer, embedding, time.monotonic(), self._scope_id(scope)
+            )
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            self._matrix = None
@@ -0,0 +1,344 @@
+"""
+Benchmarks de los componentes de `solved/rag`. No llaman a la API de OpenAI:
+usan vectores y textos sintéticos.
+
+```bash
+python -m solved.rag.bench backends [n_chunks]
+python -m solved.rag.bench fetch [n_pages]
+python -m solved.rag.bench bm25 [n_chunks]
+python -m solved.rag.bench html [fichero.html ...]
+python -m solved.rag.bench quantization [n_chunks]
+```
+"""
+
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((n, dim), dtype=np.float32)
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    ms = np.array(samples) * 1000
+    return {"p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95))}
+
+
+def max_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(backend: str, n: int, dim: int = 1536, n_queries: int = 200) -> dict:
+    """
+    Crea una colección de `n` vectores, la vuelve a abrir desde disco y mide
+    la latencia de `query` (con embeddings ya calculados).
+    """
+    import chromadb
+
+    from solved.rag.numpy_index import NumpyIndex
+
+    path = tempfile.mkdtemp()
+    vectors = synthetic_vectors(n, dim)
+    ids = [str(i) for i in range(n)]
+    docs = [f"chunk {i}" for i in range(n)]
+
+    def open_collection():
+        if backend == "chroma":
+            return chromadb.PersistentClient(path=path).get_or_create_collection(
+                "bench", embedding_function=None
+            )
+        nlist = int(np.sqrt(n)) if backend == "numpy-ivf" else None
+        return NumpyIndex(path, nlist=nlist)
+
+    collection = open_collection()
+    for i in range(0, n, 1000):
+        collection.add(
+            ids=ids[i : i + 1000],
+            documents=docs[i : i + 1000],
+            embeddings=vectors[i : i + 1000].tolist(),
+        )
+    del collection, vectors, ids, docs
+
+    collection = open_collection()
+    queries = synthetic_vectors(n_queries, dim, seed=1)
+    # Calentamos (carga de índices, IVF, memmap...)
+    collection.query(query_embeddings=queries[:1].tolist(), n_results=5)
+
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        collection.query(query_embeddings=[query.tolist()], n_results=5)
+        samples.append(time.perf_counter() - start)
+
+    return {"backend": backend, "n": n, **percentiles(samples), "max_rss_mb": max_rss_mb()}
+
+
+def backends(n: int = 20_000):
+    """
+    Cada backend se ejecuta en un proceso aparte para que el RSS sea comparable.
+    """
+    for backend in ("chroma", "numpy", "numpy-ivf"):
+        output = subprocess.run(
+            [sys.executable, "-m", "solved.rag.bench", "_backend", backend, str(n)],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        print(
+            f"{result['backend']:>10}: p50 {result['p50_ms']:.2f} ms, "
+            f"p95 {result['p95_ms']:.2f} ms, RSS máx {result['max_rss_mb']:.0f} MB"
+        )
+
+
+def synthetic_post(i: int, paragraphs: int = 50, noise: int = 0) -> str:
+    body = "".join(
+        f"<p>Paragraph {j} of post {i}. Task decomposition, <b>planning</b> and "
+        f"<a href='#m{j}'>memory</a>.</p>"
+        for j in range(paragraphs)
+    )
+    # Menús, comentarios, etc. que no forman parte del post
+    sidebar = "".join(f"<li><a href='/p/{j}'>Other post {j}</a></li>" for j in range(noise))
+    return (
+        "<html><head><title>Blog</title><script>var x = 1;</script></head><body>"
+        f"<nav><ul>{sidebar}</ul></nav>"
+        f'<h1 class="post-title">Post {i}</h1>'
+        f'<div class="post-content">{body}</div>'
+        f"<footer><ul>{sidebar}</ul></footer></body></html>"
+    )
+
+
+class PostHandler(BaseHTTPRequestHandler):
+    """
+    Sirve `/post/<i>` con `ETag` y responde 304 a las peticiones condicionales.
+    Añade una pequeña latencia para simular un servidor remoto.
+    """
+
+    protocol_version = "HTTP/1.1"
+    latency = 0.02
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        body = synthetic_post(int(self.path.rsplit("/", 1)[-1])).encode()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def fetch(n: int = 200):
+    """
+    Compara `scrape_web` (una petición tras otra, sin sesión) con
+    `fetch_pages` + `parse_post` contra un servidor HTTP local, en frío y con
+    todas las páginas sin cambios (304).
+    """
+    from solved.rag.v2 import HttpValidators, fetch_pages, parse_post, scrape_web
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PostHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f"http://127.0.0.1:{server.server_port}/post/{i}" for i in range(n)]
+
+    def report(name: str, fn):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>22}: {n / elapsed:8.1f} páginas/s")
+
+    def pooled(validators):
+        pages = list(fetch_pages(urls, validators.headers, per_host=16))
+        [parse_post(page.text) for page in pages if page.text is not None]
+        validators.update(pages)
+
+    validators = HttpValidators(tempfile.mktemp(suffix=".json"))
+    report("scrape_web", lambda: [scrape_web(url) for url in urls])
+    report("fetch_pages (200)", lambda: pooled(validators))
+    report("fetch_pages (304)", lambda: pooled(validators))
+    server.shutdown()
+
+
+def synthetic_chunks(n: int, words: int = 170, vocab: int = 50_000, seed: int = 0):
+    """
+    Chunks de ~1000 caracteres con frecuencias de palabras tipo Zipf.
+    """
+    rng = np.random.default_rng(seed)
+    ranks = np.minimum(rng.zipf(1.2, size=(n, words)), vocab)
+    return [" ".join(f"w{r}" for r in row) for row in ranks]
+
+
+def bm25(n: int = 50_000, n_queries: int = 200):
+    """
+    Latencia de consulta de `BM25Index` y memoria de los postings por millón
+    de tokens indexados.
+    """
+    from solved.rag.bm25 import BM25Index, tokenize
+
+    chunks = synthetic_chunks(n)
+    index = BM25Index()
+    start = time.perf_counter()
+    for i in range(0, n, 1000):
+        index.add([str(j) for j in range(i, i + 1000)], chunks[i : i + 1000])
+    build = time.perf_counter() - start
+
+    tokens = sum(len(tokenize(chunk)) for chunk in chunks)
+    queries = [" ".join(chunk.split()[:5]) for chunk in synthetic_chunks(n_queries, seed=1)]
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        index.query([query], n_results=10)
+        samples.append(time.perf_counter() - start)
+
+    latency = percentiles(samples)
+    print(
+        f"{n} chunks, {tokens / 1e6:.1f}M tokens, indexado en {build:.1f}s\n"
+        f"consulta: p50 {latency['p50_ms']:.2f} ms, p95 {latency['p95_ms']:.2f} ms\n"
+        f"memoria: {index.nbytes() / 2**20 / (tokens / 1e6):.1f} MB por millón de tokens"
+    )
+
+
+# HTML mal formado habitual en páginas reales: `<p>`/`<li>` sin cerrar,
+# cierres sueltos, `<script>` dentro del contenido, contenido dentro del título
+MALFORMED_POSTS = [
+    '<h1 class="post-title">T</h1><div class="post-content"><p>a<p>b</div>'
+    "<footer>FOOTER</footer>",
+    '<h1 class="post-title">T</h1><div class="post-content">x</p>y</div><p>z</p>',
+    '<h1 class="post-title">T</h1><div class="post-content"><ul><li>a<li>b</ul>'
+    "<script>var x = '</div>';</script>c<br/>d<div/>e</div>after",
+    '<h1 class="post-title">T<div class="post-content"><span>a</div>b</h1>c'
+    '<div class="post-content">no</div>',
+]
+
+
+def html(*paths: str, repeat: int = 20):
+    """
+    Compara los modos de `parse_post` sobre HTML guardado (o páginas
+    sintéticas grandes si no se pasa ninguno) y comprueba que extraen el mismo
+    texto, también con `MALFORMED_POSTS`.
+    """
+    from solved.rag.v2 import parse_post, parse_posts
+
+    if paths:
+        fixtures = []
+        for path in paths:
+            with open(path) as f:
+                fixtures.append(f.read())
+    else:
+        fixtures = [synthetic_post(i, paragraphs=500, noise=2000) for i in range(4)]
+    pages = fixtures * repeat
+    size = sum(map(len, pages)) / 2**20
+
+    checked = fixtures + MALFORMED_POSTS
+    expected = [parse_post(page, "soup") for page in checked]
+    for parser in ("strainer", "stream"):
+        assert [parse_post(page, parser) for page in checked] == expected, parser
+
+    def report(name: str, fn):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        print(f"{name:>15}: {len(pages) / elapsed:7.1f} páginas/s, {size / elapsed:6.1f} MB/s")
+
+    for parser in ("soup", "strainer", "stream"):
+        report(parser, lambda: [parse_post(page, parser) for page in pages])
+    report("stream (pool)", lambda: parse_posts(pages))
+
+
+def clustered_vectors(n: int, dim: int, clusters: int = 200, seed: int = 0):
+    """
+    Vectores agrupados en temas, más parecidos a embeddings reales que el
+    ruido gaussiano (donde todos los vecinos están a la misma distancia).
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    noise = rng.standard_normal((n, dim), dtype=np.float32)
+    return centers[rng.integers(clusters, size=n)] + 0.8 * noise
+
+
+def quantization(n: int = 50_000, dim: int = 1536, n_queries: int = 200, k: int = 10):
+    """
+    Recall@k, tamaño de los vectores y latencia de cada `dtype` de
+    `NumpyIndex` frente a la búsqueda exacta en float32.
+
+    El tamaño en disco incluye la copia en float32 que se guarda con `rerank`
+    (`vectors.f32`); la búsqueda solo recorre los vectores cuantizados (y las
+    escalas). float16 e int8 ocupan menos, pero cada bloque se convierte a
+    float32 para multiplicar y la búsqueda es varias veces más lenta.
+    """
+    from solved.rag.numpy_index import NumpyIndex, normalize
+
+    vectors = clustered_vectors(n, dim)
+    queries = clustered_vectors(n_queries, dim, seed=1)
+    truth = np.argsort(-(normalize(vectors) @ normalize(queries).T), axis=0)[:k].T
+
+    configs = [("float32", 0), ("float16", 0), ("int8", 0), ("int8", 50)]
+    for dtype, rerank in configs:
+        index = NumpyIndex(tempfile.mkdtemp(), dtype=dtype, rerank=rerank)
+        for i in range(0, n, 5000):
+            index.add(
+                ids=[str(j) for j in range(i, min(i + 5000, n))],
+                documents=[""] * len(vectors[i : i + 5000]),
+                embeddings=vectors[i : i + 5000],
+            )
+
+        samples, recall = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            ids = index.query(query_embeddings=[query], n_results=k)["ids"][0]
+            samples.append(time.perf_counter() - start)
+            recall += len(set(map(int, ids)) & set(expected)) / k
+
+        searched = index.vectors.nbytes + (
+            0 if index.scales is None else index.scales.nbytes
+        )
+        on_disk = sum(
+            os.path.getsize(path)
+            for path in {index.vectors_path, index.scales_path, index.full_path}
+            if os.path.exists(path)
+        )
+        latency = percentiles(samples)
+        name = dtype + (f" + rerank {rerank}" if rerank else "")
+        print(
+            f"{name:>18}: recall@{k} {recall / n_queries:.3f}, "
+            f"{on_disk / 2**20:6.1f} MB en disco, "
+            f"{searched / 2**20:6.1f} MB en la búsqueda, "
+            f"p50 {latency['p50_ms']:.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    command, args = sys.argv[1], sys.argv[2:]
+    if command == "backends":
+        backends(*map(int, args))
+    elif command == "quantization":
+        quantization(*map(int, args))
+    elif command == "html":
+        html(*args)
+    elif command == "bm25":
+        bm25(*map(int, args))
+    elif command == "fetch":
+        fetch(*map(int, args))
+    elif command == "_backend":
+        print(json.dumps(run_backend(args[0], int(args[1]))))
+    else:
+        raise SystemExit(__doc__)
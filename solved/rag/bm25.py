@@ -0,0 +1,147 @@
+"""
+Índice léxico (BM25) en memoria para los mismos chunks que la colección
+vectorial.
+
+Sirve para búsquedas sin llamadas a la red (no hace falta calcular el embedding
+de la pregunta) y funciona mejor que los embeddings con identificadores exactos
+(`text-embedding-ada-002`, nombres de funciones...). Se puede combinar con la
+búsqueda vectorial con `reciprocal_rank_fusion`.
+
+Cada término tiene sus postings en dos `array` de enteros (filas y
+frecuencias), que se leen con `np.frombuffer` sin copiar para puntuar con
+operaciones vectorizadas. Los borrados marcan la fila como eliminada.
+"""
+
+import math
+import re
+from array import array
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab: dict[str, int] = {}
+        self.postings: list[array] = []
+        self.freqs: list[array] = []
+        self.ids: list[str] = []
+        self.documents: list[str] = []
+        self.metadatas: list[dict] = []
+        self.rows: dict[str, int] = {}
+        self.lengths = array("I")
+        self.alive = bytearray()
+        self.total_length = 0
+
+    @classmethod
+    def from_collection(cls, collection, **kwargs) -> "BM25Index":
+        index = cls(**kwargs)
+        records = collection.get(include=["documents", "metadatas"])
+        index.add(records["ids"], records["documents"], records["metadatas"])
+        return index
+
+    def count(self) -> int:
+        return len(self.rows)
+
+    def add(self, ids, documents, metadatas=None):
+        metadatas = metadatas or [{} for _ in ids]
+        for id, document, metadata in zip(ids, documents, metadatas):
+            if id in self.rows:
+                continue
+            row = len(self.ids)
+            self.rows[id] = row
+            self.ids.append(id)
+            self.documents.append(document)
+            self.metadatas.append(metadata)
+
+            terms = {}
+            tokens = tokenize(document)
+            for token in tokens:
+                terms[token] = terms.get(token, 0) + 1
+            for token, freq in terms.items():
+                term = self.vocab.setdefault(token, len(self.vocab))
+                if term == len(self.postings):
+                    self.postings.append(array("I"))
+                    self.freqs.append(array("I"))
+                self.postings[term].append(row)
+                self.freqs[term].append(freq)
+
+            self.lengths.append(len(tokens))
+            self.alive.append(1)
+            self.total_length += len(tokens)
+
+    def delete(self, ids):
+        for id in ids:
+            row = self.rows.pop(id, None)
+            if row is not None:
+                self.alive[row] = 0
+                self.total_length -= self.lengths[row]
+
+    def scores(self, question: str) -> np.ndarray:
+        """
+        Puntuación BM25 de todas las filas para la pregunta.
+        """
+        n_docs = len(self.rows)
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        if not n_docs:
+            return scores
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32)
+        norm = self.k1 * (1 - self.b + self.b * lengths / (self.total_length / n_docs))
+
+        for token in set(tokenize(question)):
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            rows = np.frombuffer(self.postings[term], dtype=np.uint32)
+            tf = np.frombuffer(self.freqs[term], dtype=np.uint32).astype(np.float32)
+            # `df` incluye filas borradas: es una aproximación aceptable hasta
+            # reconstruir el índice
+            df = len(rows)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tf * (self.k1 + 1) / (tf + norm[rows])
+
+        scores[np.frombuffer(self.alive, dtype=np.uint8) == 0] = 0
+        return scores
+
+    def query(self, query_texts: list[str], n_results: int = 10):
+        """
+        Misma forma de resultado que `collection.query` de chroma. Como
+        `distances` se devuelve la puntuación BM25 negada (menor es mejor).
+        """
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for question in query_texts:
+            scores = self.scores(question)
+            k = min(n_results, int(np.count_nonzero(scores)))
+            top = np.argpartition(-scores, k - 1)[:k] if k else np.array([], int)
+            top = top[np.argsort(-scores[top])]
+            result["ids"].append([self.ids[row] for row in top])
+            result["documents"].append([self.documents[row] for row in top])
+            result["metadatas"].append([self.metadatas[row] for row in top])
+            result["distances"].append((-scores[top]).tolist())
+        return result
+
+    def nbytes(self) -> int:
+        """
+        Memoria de los postings, frecuencias y longitudes (sin los textos).
+        """
+        arrays = [*self.postings, *self.freqs, self.lengths]
+        return sum(a.itemsize * len(a) for a in arrays) + len(self.alive)
+
+
+def reciprocal_rank_fusion(*rankings: list[str], k: int = 60) -> list[str]:
+    """
+    Combina varias listas de IDs ordenadas por relevancia (Reciprocal Rank
+    Fusion): cada ID suma `1 / (k + posición)` en cada lista en la que aparece.
+    """
+    scores = {}
+    for ranking in rankings:
+        for position, id in enumerate(ranking):
+            scores[id] = scores.get(id, 0) + 1 / (k + position + 1)
+    return sorted(scores, key=scores.get, reverse=True)
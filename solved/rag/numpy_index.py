@@ -0,0 +1,449 @@
+"""
+Índice vectorial en memoria con NumPy, alternativa a `chromadb` para
+colecciones de hasta unos cientos de miles de chunks.
+
+Implementa el subconjunto de la API de una colección de chroma que usamos en
+`v2.py` (`add`, `get`, `delete`, `query`, `count`, `metadata` y `modify`),
+así que se puede cambiar de backend sin tocar el resto del pipeline.
+
+En disco (`path/`):
+
+- `vectors.f32`: embeddings normalizados en float32, una fila por chunk. Se lee
+  con `np.memmap`, así que cargar el índice no copia la matriz.
+- `records.jsonl`: log de altas (`id`, `document`, `metadata`) y bajas. La fila
+  de cada alta es su posición en el log.
+
+Los vectores se escriben antes que el log: si el proceso muere entre ambas
+escrituras quedan filas sin alta al final de los ficheros de vectores (o una
+línea a medias en el log), que se recortan al abrir el índice para que las
+filas sigan alineadas.
+
+`get(where={"source": ...})` usa un índice `source -> filas` en memoria en vez
+de recorrer todas las filas (`sync_db` lo llama una vez por página).
+
+La búsqueda es exacta (producto matricial + `argpartition`). Para colecciones
+grandes se puede activar una partición IVF (`nlist`): se agrupan los vectores
+con k-means y cada consulta solo compara con las `nprobe` particiones más
+cercanas.
+
+Para reducir memoria y disco los vectores se pueden guardar cuantizados
+(`dtype="float16"` o `"int8"` con una escala por vector, `vectors.f16` o
+`vectors.i8` + `scales.f32`) y se busca directamente sobre ellos. Con
+`rerank=n` se guardan también en float32 y los `n` mejores candidatos se
+reordenan con la similitud exacta (solo se leen esas filas del memmap).
+
+Ojo con los costes (`python -m solved.rag.bench quantization`):
+
+- Con `rerank` se guarda una copia completa en float32 (`vectors.f32`): en
+  disco ocupa más que float32 solo. Lo que se ahorra es la memoria que recorre
+  cada búsqueda.
+- NumPy no multiplica float16 ni int8 con BLAS: cada bloque se convierte a
+  float32 y la búsqueda es varias veces más lenta que en float32 (con 20k
+  vectores de 1536, ~9x en float16 y ~4x en int8). Solo compensa si falta
+  memoria.
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def kmeans(vectors: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """
+    k-means esférico (similitud coseno) sencillo. Devuelve los centroides.
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iters):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(k):
+            members = vectors[assignments == i]
+            if len(members):
+                centroids[i] = members.sum(axis=0)
+        centroids = normalize(centroids)
+    return centroids
+
+
+STORAGE = {
+    "float32": ("vectors.f32", np.float32),
+    "float16": ("vectors.f16", np.float16),
+    "int8": ("vectors.i8", np.int8),
+}
+
+# Filas por bloque al puntuar vectores cuantizados: acota la memoria temporal
+# de convertirlos a float32
+BLOCK_ROWS = 8192
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    Devuelve los vectores en `dtype` y, para int8, la escala de cada vector
+    (`vector ≈ cuantizado * escala`).
+    """
+    if dtype == "int8":
+        scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127
+        quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    return vectors.astype(STORAGE[dtype][1]), None
+
+
+def top_k(rows: np.ndarray, scores: np.ndarray, k: int):
+    k = min(k, int(np.isfinite(scores).sum()))
+    if not k:
+        return rows[:0], scores[:0]
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return rows[top], scores[top]
+
+
+class NumpyIndex:
+    def __init__(
+        self,
+        path: str,
+        embedding_function=None,
+        nlist: int | None = None,
+        nprobe: int = 8,
+        dtype: str = "float32",
+        rerank: int = 0,
+    ):
+        if dtype not in STORAGE:
+            raise ValueError(f"dtype no soportado: {dtype}")
+        self.path = path
+        self.embedding_function = embedding_function
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.dtype = dtype
+        self.rerank = rerank
+        self.vectors_path = os.path.join(path, STORAGE[dtype][0])
+        self.scales_path = os.path.join(path, "scales.f32")
+        self.full_path = os.path.join(path, "vectors.f32")
+        self.records_path = os.path.join(path, "records.jsonl")
+        self.metadata_path = os.path.join(path, "metadata.json")
+        self.config_path = os.path.join(path, "config.json")
+        self.lock = threading.Lock()
+
+        self.dim = None
+        self.metadata = None
+        self.ids: list[str] = []
+        self.documents: list[str] = []
+        self.metadatas: list[dict] = []
+        self.rows: dict[str, int] = {}
+        # Filas de cada `source` (incluidas las borradas, que filtra `alive`)
+        self.by_source: dict[str, list[int]] = {}
+        self.alive = np.zeros(0, dtype=bool)
+        self._mmaps = {}
+        self._centroids = None
+        self._lists = None
+        self._load()
+
+    # Persistencia
+
+    def _load(self):
+        os.makedirs(self.path, exist_ok=True)
+        config = {"dtype": self.dtype, "full": self.dtype == "float32" or self.rerank > 0}
+        if os.path.exists(self.config_path):
+            with open(self.config_path) as f:
+                stored = json.load(f)
+            if stored["dtype"] != self.dtype or (self.rerank and not stored["full"]):
+                raise ValueError(
+                    f"El índice de {self.path} se creó con {stored}, no con {config}"
+                )
+            config = stored
+        else:
+            with open(self.config_path, "w") as f:
+                json.dump(config, f)
+        self.keep_full = config["full"]
+
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path) as f:
+                self.metadata = json.load(f)
+        deleted = set()
+        if os.path.exists(self.records_path):
+            with open(self.records_path, "rb+") as f:
+                data = f.read()
+                # Una línea a medias es un alta que no llegó a completarse
+                complete = data.rfind(b"\n") + 1
+                if complete < len(data):
+                    f.truncate(complete)
+            for line in data[:complete].decode().splitlines():
+                record = json.loads(line)
+                if "delete" in record:
+                    deleted.add(self.rows.pop(record["delete"], None))
+                    continue
+                if self.dim is None:
+                    self.dim = record["dim"]
+                self._index_row(record["id"], record["document"], record["metadata"])
+        self.alive = np.ones(len(self.ids), dtype=bool)
+        self.alive[[row for row in deleted if row is not None]] = False
+        self._reconcile()
+
+    def _vector_files(self) -> list[tuple[str, int]]:
+        """
+        Ficheros de vectores con los bytes de cada fila.
+        """
+        if self.dim is None:
+            width = 0
+        else:
+            width = self.dim * np.dtype(STORAGE[self.dtype][1]).itemsize
+        files = [(self.vectors_path, width)]
+        if self.dtype == "int8":
+            files.append((self.scales_path, 4))
+        if self.keep_full and self.dtype != "float32":
+            files.append((self.full_path, self.dim * 4 if self.dim else 0))
+        return files
+
+    def _reconcile(self):
+        """
+        Recorta las filas de vectores que no tienen alta en el log.
+        """
+        for path, row_bytes in self._vector_files():
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            expected = len(self.ids) * row_bytes
+            if size < expected:
+                raise ValueError(
+                    f"{path} tiene {size} bytes, pero el log necesita {expected}"
+                )
+            if size > expected:
+                with open(path, "ab") as f:
+                    f.truncate(expected)
+
+    def _index_row(self, id: str, document: str, metadata: dict):
+        row = len(self.ids)
+        self.rows[id] = row
+        self.ids.append(id)
+        self.documents.append(document)
+        self.metadatas.append(metadata)
+        source = metadata.get("source") if metadata else None
+        if source is not None:
+            self.by_source.setdefault(source, []).append(row)
+
+    def _append_log(self, records: list[dict]):
+        with open(self.records_path, "a") as f:
+            f.write("".join(json.dumps(record) + "\n" for record in records))
+
+    def _mmap(self, path: str, dtype, width: int | None) -> np.ndarray:
+        # Reabrimos el memmap solo si se han añadido filas desde la última vez
+        mmap = self._mmaps.get(path)
+        if mmap is None or len(mmap) < len(self.ids):
+            if not self.ids:
+                return np.zeros((0,) if width is None else (0, width), dtype=dtype)
+            shape = (len(self.ids),) if width is None else (len(self.ids), width)
+            mmap = self._mmaps[path] = np.memmap(path, dtype=dtype, mode="r", shape=shape)
+        return mmap
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """
+        Vectores tal y como se guardan (cuantizados o no).
+        """
+        return self._mmap(self.vectors_path, STORAGE[self.dtype][1], self.dim)
+
+    @property
+    def scales(self) -> np.ndarray | None:
+        if self.dtype != "int8":
+            return None
+        return self._mmap(self.scales_path, np.float32, None)
+
+    @property
+    def full(self) -> np.ndarray:
+        """
+        Vectores en float32 (solo si `keep_full`).
+        """
+        return self._mmap(self.full_path, np.float32, self.dim)
+
+    def _dequantize(self, rows) -> np.ndarray:
+        vectors = self.vectors[rows].astype(np.float32)
+        if self.dtype == "int8":
+            vectors *= self.scales[rows][:, None]
+        return vectors
+
+    def _scores(self, rows: np.ndarray | None, queries: np.ndarray) -> np.ndarray:
+        """
+        Similitud aproximada (sobre los vectores guardados) de `rows` (o de
+        todas las filas) con cada consulta: matriz `(filas, consultas)`.
+        """
+        if self.dtype == "float32" and rows is None:
+            return self.vectors @ queries.T
+
+        n = len(self.ids) if rows is None else len(rows)
+        scores = np.empty((n, len(queries)), dtype=np.float32)
+        for start in range(0, n, BLOCK_ROWS):
+            block = slice(start, start + BLOCK_ROWS)
+            block_rows = block if rows is None else rows[block]
+            data = self.vectors[block_rows].astype(np.float32, copy=False)
+            scores[block] = data @ queries.T
+            if self.dtype == "int8":
+                scores[block] *= self.scales[block_rows][:, None]
+        return scores
+
+    # API compatible con una colección de chroma
+
+    def modify(self, metadata: dict):
+        self.metadata = metadata
+        # Otro proceso puede estar leyéndolo (`stored_metadata`)
+        with open(self.metadata_path + ".tmp", "w") as f:
+            json.dump(metadata, f)
+        os.replace(self.metadata_path + ".tmp", self.metadata_path)
+
+    def stored_metadata(self) -> dict | None:
+        """
+        Metadatos tal y como están en disco: incluyen los cambios de otros
+        procesos, que `metadata` no ve.
+        """
+        if not os.path.exists(self.metadata_path):
+            return None
+        with open(self.metadata_path) as f:
+            return json.load(f)
+
+    def count(self) -> int:
+        return int(self.alive.sum())
+
+    def add(self, ids, documents, metadatas=None, embeddings=None):
+        ids = [ids] if isinstance(ids, str) else list(ids)
+        documents = [documents] if isinstance(documents, str) else list(documents)
+        metadatas = metadatas or [{} for _ in ids]
+        if embeddings is None:
+            embeddings = self.embedding_function(documents)
+        vectors = normalize(embeddings)
+
+        with self.lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            # Igual que chroma: los IDs existentes (o repetidos) se ignoran
+            new, seen = [], set(self.rows)
+            for i, id in enumerate(ids):
+                if id not in seen:
+                    new.append(i)
+                    seen.add(id)
+            if not new:
+                return
+            vectors = vectors[new]
+
+            quantized, scales = quantize(vectors, self.dtype)
+            with open(self.vectors_path, "ab") as f:
+                f.write(quantized.tobytes())
+            if scales is not None:
+                with open(self.scales_path, "ab") as f:
+                    f.write(scales.tobytes())
+            if self.keep_full and self.dtype != "float32":
+                with open(self.full_path, "ab") as f:
+                    f.write(vectors.tobytes())
+            self._append_log(
+                [
+                    {
+                        "id": ids[i],
+                        "document": documents[i],
+                        "metadata": metadatas[i],
+                        "dim": self.dim,
+                    }
+                    for i in new
+                ]
+            )
+            start = len(self.ids)
+            for i in new:
+                self._index_row(ids[i], documents[i], metadatas[i])
+            self.alive = np.concatenate([self.alive, np.ones(len(new), dtype=bool)])
+
+            if self._centroids is not None:
+                assignments = np.argmax(vectors @ self._centroids.T, axis=1)
+                for row, list_id in zip(range(start, len(self.ids)), assignments):
+                    self._lists[list_id] = np.append(self._lists[list_id], row)
+
+    def delete(self, ids):
+        with self.lock:
+            rows = [self.rows.pop(id) for id in ids if id in self.rows]
+            self.alive[rows] = False
+            self._append_log([{"delete": self.ids[row]} for row in rows])
+
+    def _matches(self, metadata: dict, where: dict | None) -> bool:
+        return not where or all(metadata.get(k) == v for k, v in where.items())
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas")):
+        if ids is not None:
+            rows = [self.rows[id] for id in ids if id in self.rows]
+        elif where and "source" in where:
+            rows = [r for r in self.by_source.get(where["source"], []) if self.alive[r]]
+        else:
+            rows = np.flatnonzero(self.alive)
+        rows = [row for row in rows if self._matches(self.metadatas[row], where)]
+        result = {"ids": [self.ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self.documents[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self.metadatas[row] for row in rows]
+        return result
+
+    def query(
+        self,
+        query_texts=None,
+        query_embeddings=None,
+        n_results: int = 10,
+        include=("documents", "metadatas", "distances"),
+    ):
+        if query_embeddings is None:
+            query_embeddings = self.embedding_function(query_texts)
+        queries = normalize(query_embeddings)
+
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for rows, scores in self._search(queries, n_results):
+            result["ids"].append([self.ids[row] for row in rows])
+            result["documents"].append([self.documents[row] for row in rows])
+            result["metadatas"].append([self.metadatas[row] for row in rows])
+            # Distancia coseno, como `hnsw:space = cosine` en chroma
+            result["distances"].append((1 - scores).tolist())
+
+        return {key: value for key, value in result.items() if key == "ids" or key in include}
+
+    def _search(self, queries: np.ndarray, k: int):
+        """
+        Devuelve, para cada consulta, las filas de los `k` vectores más
+        similares y su similitud, ordenados de mayor a menor.
+        """
+        if not self.ids:
+            return [(np.array([], int), np.array([]))] * len(queries)
+
+        # Con re-rank buscamos más candidatos sobre los vectores cuantizados
+        candidates = max(k, self.rerank)
+        if not self.nlist or len(self.ids) < self.nlist * 39:
+            # Búsqueda exacta de todas las consultas con un único producto
+            # matricial. Con pocos vectores por partición el IVF no compensa.
+            scores = self._scores(None, queries)
+            scores[~self.alive] = -np.inf
+            everything = np.arange(len(self.ids))
+            results = [top_k(everything, column, candidates) for column in scores.T]
+        else:
+            if self._centroids is None:
+                self.build_ivf()
+            nearest = np.argsort(-(queries @ self._centroids.T), axis=1)
+            results = []
+            for query, lists in zip(queries, nearest[:, : self.nprobe]):
+                rows = np.concatenate([self._lists[i] for i in lists])
+                scores = self._scores(rows, query[None])[:, 0]
+                scores[~self.alive[rows]] = -np.inf
+                results.append(top_k(rows, scores, candidates))
+
+        if not self.rerank:
+            return results
+        return [
+            top_k(rows, self.full[rows] @ query, k)
+            for (rows, _), query in zip(results, queries)
+        ]
+
+    # IVF
+
+    def build_ivf(self, iters: int = 10):
+        n = len(self.ids)
+        sample = np.random.default_rng(0).choice(
+            n, size=min(n, self.nlist * 256), replace=False
+        )
+        self._centroids = kmeans(self._dequantize(np.sort(sample)), self.nlist, iters)
+        assignments = np.argmax(self._scores(None, self._centroids), axis=1)
+        self._lists = [np.flatnonzero(assignments == i) for i in range(self.nlist)]
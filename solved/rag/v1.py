@@ -14,8 +14,12 @@ Podéis ver un ejemplo donde remplazo el scrapping, el doc loader y el splitter
 en `v2.py`.
 """
 
+import json
 import sys
+import time
 import warnings
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 import bs4
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
@@ -25,6 +29,8 @@ from langchain_core.documents import Document
 from openai import OpenAI
 from dotenv import load_dotenv
 
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+
 warnings.filterwarnings("ignore", message="API key must be provided")
 load_dotenv()
 
@@ -87,8 +93,15 @@ docs = loader.load()
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000,
                                                chunk_overlap=200)
 splits = text_splitter.split_documents(docs)
-vectorstore = Chroma.from_documents(documents=splits,
-                                    embedding=OpenAIEmbeddings())
+# Cacheamos los embeddings en disco: en cada ejecución solo se paga por los
+# chunks que no se han visto antes
+embeddings = OpenAIEmbeddings()
+vectorstore = Chroma.from_documents(
+    documents=splits,
+    embedding=CachedEmbeddings(
+        embeddings, EmbeddingCache("./embeddingcache", embeddings.model)
+    ),
+)
 
 retriever = vectorstore.as_retriever()
 
@@ -104,7 +117,56 @@ def chatbot(question: str):
     return llm(prompt(docs, question))
 
 
+def read_questions(source) -> list[str]:
+    """
+    Una pregunta por línea: texto plano o JSON (`{"question": "..."}`).
+    """
+    lines = (line.strip() for line in source)
+    return [
+        json.loads(line)["question"] if line.startswith("{") else line
+        for line in lines
+        if line
+    ]
+
+
+def chatbot_batch(questions: list[str], max_workers: int = 8):
+    """
+    Como `chatbot` pero para muchas preguntas: un único cálculo de embeddings
+    para todas las preguntas y las llamadas a la LLM en paralelo. Devuelve los
+    resultados en orden según están listos.
+    """
+    start = time.perf_counter()
+    vectors = vectorstore.embeddings.embed_documents(questions)
+    contexts = [vectorstore.similarity_search_by_vector(v) for v in vectors]
+    retrieval = time.perf_counter() - start
+
+    def answer(item):
+        question, docs = item
+        start = time.perf_counter()
+        result = {"question": question}
+        try:
+            result["answer"] = llm(prompt(docs, question))
+        except Exception as e:
+            result["error"] = repr(e)
+        result["timings"] = {
+            "retrieval": retrieval,
+            "generation": time.perf_counter() - start,
+        }
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        yield from pool.map(answer, zip(questions, contexts))
+
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["--batch"]:
+        # python -m solved.rag.v1 --batch [preguntas.jsonl | -]
+        path = sys.argv[2] if len(sys.argv) > 2 else "-"
+        with nullcontext(sys.stdin) if path == "-" else open(path) as source:
+            for result in chatbot_batch(read_questions(source)):
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+        sys.exit()
+
     if len(sys.argv) > 1:
         question = sys.argv[1]
     else:
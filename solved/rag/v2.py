@@ -15,12 +15,61 @@ y es muy sencillo de entender
 Extra:
 - Persistimos la BBDD para evitar costes de creación de la colección en cada
   ejecución
+- Ingesta por lotes (`ingest`): agrupamos los chunks, calculamos los embeddings
+  de varios lotes en paralelo y escribimos cada lote con un único `add`
+- IDs deterministas por chunk (`chunk_id`) y sincronización incremental
+  (`sync_db`): solo se calculan embeddings de los chunks nuevos y se borran los
+  que han desaparecido de la fuente. Los chunks con IDs `uuid4` de versiones
+  anteriores (sin `source`) se borran en la primera sincronización
+- Descarga de páginas (`fetch_pages`) en paralelo, con conexiones reutilizadas
+  y peticiones condicionales (`ETag`/`Last-Modified`): las páginas que no han
+  cambiado llegan como un 304 y no se vuelven a procesar (`crawl`)
+- Extracción del HTML en streaming (`PostExtractor`): solo se procesa el texto
+  del título y del contenido del post, sin construir el árbol completo
+- `text_splitter` en streaming y en tiempo lineal. Cada chunk conserva su
+  posición en el texto original (`start`, `end`), que guardamos como metadatos
+- Cacheamos los embeddings en disco (`embedding_cache`) para no volver a pagar
+  por texto que ya hemos visto (por ejemplo al reconstruir la colección)
+- Backend de búsqueda intercambiable (`RAG_BACKEND=numpy`): `NumpyIndex` es un
+  índice exacto en memoria que evita la serialización y SQLite de chroma (ver
+  `numpy_index.py` y `python -m solved.rag.bench backends`). Puede guardar los
+  vectores cuantizados (`RAG_VECTOR_DTYPE=float16|int8`, `RAG_RERANK=n`)
+- El corpus se prepara una sola vez por proceso (`warm_up`); cada pregunta solo
+  paga la búsqueda y la generación (ver los tiempos por etapa en stderr)
+- Caché semántica de respuestas (`answer_cache.py`) para preguntas casi
+  idénticas (umbral configurable con `RAG_CACHE_THRESHOLD`). Se invalida si
+  cambia la revisión guardada de la colección, que se relee cada
+  `RAG_REVISION_CHECK` segundos
+- El contexto del prompt se empaqueta (`pack_context`): se unen los chunks
+  solapados, se quitan duplicados y se limita a un presupuesto de tokens
+- Búsqueda léxica (BM25, `bm25.py`) sin llamadas a la red o híbrida con la
+  vectorial (`RAG_RETRIEVAL=lexical|hybrid`)
+- Respuesta en streaming (`--stream`): se imprime según llega y se mide el
+  tiempo hasta el primer token
+- Modo batch (`--batch`): lee preguntas en JSONL de un fichero o de stdin y
+  escribe las respuestas en JSONL
 """
 
+import hashlib
+import json
 import os
 import re
 import sys
-from typing import Generator
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from functools import cache, partial
+from html.parser import HTMLParser
+from typing import Callable, Generator, Iterable, NamedTuple, TextIO
+from urllib.parse import urlsplit
 from uuid import uuid4
 
 import bs4
@@ -32,11 +81,31 @@ import requests
 from dotenv import load_dotenv
 from openai import OpenAI
 
+from embedding_cache import CachedEmbeddingFunction, EmbeddingCache
+from http_session import make_session
+from solved.rag.answer_cache import SemanticCache
+from solved.rag.bm25 import BM25Index, reciprocal_rank_fusion
+from solved.rag.numpy_index import NumpyIndex
+
 load_dotenv()
 
 client = OpenAI()
 db = chromadb.PersistentClient(path="./ragdatabase")
 
+BACKEND = os.getenv("RAG_BACKEND", "chroma")
+RETRIEVAL = os.getenv("RAG_RETRIEVAL", "vector")
+STORE_PATHS = {"chroma": "./ragdatabase", "numpy": "./ragindex"}
+URLS = ["https://lilianweng.github.io/posts/2023-06-23-agent/"]
+
+lexical_indexes: dict[str, BM25Index] = {}
+# Colecciones (`id`) en las que ya se han buscado chunks antiguos sin `source`
+legacy_checked: set[int] = set()
+answer_cache = SemanticCache(threshold=float(os.getenv("RAG_CACHE_THRESHOLD", 0.95)))
+# Cada cuántos segundos se vuelve a leer la revisión guardada de la colección
+# (otro proceso puede haberla sincronizado): backend -> (momento, revisión)
+REVISION_CHECK_INTERVAL = float(os.getenv("RAG_REVISION_CHECK", 5))
+revision_checks: dict[str, tuple[float, str | None]] = {}
+
 
 def llm(prompt: str, model: str = "gpt-4o-mini") -> str:
     response = client.chat.completions.create(
@@ -45,6 +114,44 @@ def llm(prompt: str, model: str = "gpt-4o-mini") -> str:
     return response.choices[0].message.content
 
 
+def llm_stream(prompt: str, model: str = "gpt-4o-mini") -> Generator[str, None, None]:
+    """
+    Como `llm` pero devuelve el texto según llega (deltas). Si se deja de
+    consumir el generador se cierra la conexión.
+    """
+    stream = client.chat.completions.create(
+        model=model, messages=[{"role": "user", "content": prompt}], stream=True
+    )
+    try:
+        for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+    finally:
+        stream.close()
+
+
+def print_stream(
+    deltas: Iterable[str],
+    timings: dict[str, float] | None = None,
+    start: float | None = None,
+) -> str:
+    """
+    Imprime los deltas según llegan y devuelve el texto completo. Si se pasa
+    `timings` guarda el tiempo hasta el primer token (`ttft`) y el total,
+    medidos desde `start` (por defecto, desde ahora).
+    """
+    start, text = start or time.perf_counter(), []
+    for delta in deltas:
+        if not text and timings is not None:
+            timings["ttft"] = time.perf_counter() - start
+        print(delta, end="", flush=True)
+        text.append(delta)
+    print()
+    if timings is not None:
+        timings["total"] = time.perf_counter() - start
+    return "".join(text)
+
+
 def prompt(docs: list[str], question: str) -> str:
     return f"""HUMAN
 
@@ -57,14 +164,306 @@ Context: {'\n\n'.join(docs)}
 Answer:"""
 
 
-def scrape_web(url: str) -> str:
-    response = requests.get(url)
-    soup = bs4.BeautifulSoup(response.text, "html.parser")
-    elements = [soup.find(class_="post-title"), soup.find(class_="post-content")]
+def estimate_tokens(text: str) -> int:
+    # Aproximación habitual para texto en inglés: ~4 caracteres por token
+    return len(text) // 4 + 1
+
+
+class Span(NamedTuple):
+    source: str | None
+    start: int
+    end: int
+    text: str
+
+
+def merge_spans(a: Span, b: Span) -> Span:
+    """
+    Une dos fragmentos solapados o contiguos de la misma fuente.
+    """
+    first, second = (a, b) if a.start <= b.start else (b, a)
+    if second.end <= first.end:
+        return first
+    if second.start > first.end:
+        # Contiguos: solo les separan caracteres de separación
+        text = first.text + " " + second.text
+    else:
+        text = first.text + second.text[first.end - second.start :]
+    return Span(first.source, first.start, second.end, text)
+
+
+def pack_context(
+    documents: list[str],
+    metadatas: list[dict] | None = None,
+    token_budget: int = 1000,
+    max_gap: int = 2,
+) -> list[str]:
+    """
+    Prepara el contexto del prompt a partir de los chunks recuperados (en orden
+    de relevancia):
+
+    - Los chunks que se solapan (el `chunk_overlap` del splitter) o son
+      contiguos en la misma fuente se unen en un único fragmento sin repetir
+      texto
+    - Los fragmentos duplicados se descartan
+    - Se añaden por orden de relevancia mientras quepan en `token_budget`
+
+    Sin metadatos de posición (`source`, `start`, `end`) solo se deduplica.
+    """
+    metadatas = metadatas or [{} for _ in documents]
+    spans: list[Span] = []
+    seen, used = set(), 0
+    for text, metadata in zip(documents, metadatas):
+        if text in seen:
+            continue
+        seen.add(text)
+
+        span = Span(
+            metadata.get("source"),
+            metadata.get("start", -1),
+            metadata.get("end", -1),
+            text,
+        )
+        mergeable = [
+            i
+            for i, other in enumerate(spans)
+            if span.source is not None
+            and other.source == span.source
+            and span.start >= 0
+            and span.start <= other.end + max_gap
+            and other.start <= span.end + max_gap
+        ]
+        merged = span
+        for i in mergeable:
+            merged = merge_spans(spans[i], merged)
+
+        # Solo cuenta el texto nuevo que aporta este chunk
+        cost = estimate_tokens(merged.text) - sum(
+            estimate_tokens(spans[i].text) for i in mergeable
+        )
+        if used + cost > token_budget:
+            continue
+        used += cost
+
+        if mergeable:
+            # El fragmento unido ocupa la posición del más relevante
+            spans[mergeable[0]] = merged
+            for i in reversed(mergeable[1:]):
+                del spans[i]
+        else:
+            spans.append(merged)
+
+    return [span.text for span in spans]
+
+
+POST_CLASSES = ("post-title", "post-content")
+VOID_TAGS = frozenset(
+    "area base br col embed hr img input link meta param source track wbr".split()
+)
+
+
+class PostExtractor(HTMLParser):
+    """
+    Extrae en streaming el texto del primer elemento de cada clase de
+    `POST_CLASSES` sin construir el árbol del documento. Como `get_text` de
+    BeautifulSoup, ignora el contenido de `<script>` y `<style>`.
+
+    Para cerrar los elementos igual que el `html.parser` de BeautifulSoup con
+    HTML mal formado, se guarda la pila de etiquetas abiertas dentro del
+    elemento: una etiqueta de cierre cierra todo lo abierto hasta su apertura
+    (los `<p>` y `<li>` sin cerrar) y se ignora si no hay ninguna abierta.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.texts: dict[str, list[str]] = {}
+        # Etiquetas abiertas dentro de cada elemento que estamos capturando (el
+        # contenido puede estar dentro del título en HTML mal formado)
+        self.stacks: dict[str, list[str]] = {}
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in VOID_TAGS:
+            for stack in self.stacks.values():
+                stack.append(tag)
+        classes = (dict(attrs).get("class") or "").split()
+        for name in POST_CLASSES:
+            if name in classes and name not in self.texts:
+                self.texts[name] = []
+                if tag not in VOID_TAGS:
+                    self.stacks[name] = [tag]
+
+    def handle_endtag(self, tag):
+        for name, stack in list(self.stacks.items()):
+            if tag in stack:
+                del stack[len(stack) - 1 - stack[::-1].index(tag) :]
+                if not stack:
+                    del self.stacks[name]
+
+    def handle_data(self, data):
+        for name, stack in self.stacks.items():
+            if "script" not in stack and "style" not in stack:
+                self.texts[name].append(data)
+
+
+def parse_post(html: str, parser: str = "stream") -> str:
+    """
+    Texto del título y del contenido de un post.
+
+    - `soup`: árbol completo con BeautifulSoup (lo más robusto y lo más lento)
+    - `strainer`: BeautifulSoup solo con los subárboles de `POST_CLASSES`
+    - `stream`: `PostExtractor`, sin construir ningún árbol
+    """
+    if parser == "stream":
+        extractor = PostExtractor()
+        extractor.feed(html)
+        extractor.close()
+        return " ".join("".join(extractor.texts.get(name, [])) for name in POST_CLASSES)
+
+    if parser == "strainer":
+        strainer = bs4.SoupStrainer(class_=POST_CLASSES)
+        soup = bs4.BeautifulSoup(html, "html.parser", parse_only=strainer)
+    elif parser == "soup":
+        soup = bs4.BeautifulSoup(html, "html.parser")
+    else:
+        raise ValueError(f"Parser desconocido: {parser}")
+    elements = [soup.find(class_=name) for name in POST_CLASSES]
     return " ".join([element.get_text() for element in elements])
 
 
-def text_splitter(doc: str, chunk_size: int = 1000, chunk_overlap: int = 200):
+def parse_posts(
+    htmls: Iterable[str], parser: str = "stream", processes: int | None = None
+) -> list[str]:
+    """
+    `parse_post` en paralelo con un pool de procesos, para descargas masivas
+    (el parseo es CPU puro y no se beneficia de hilos).
+    """
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(partial(parse_post, parser=parser), htmls, chunksize=8))
+
+
+def scrape_web(url: str) -> str:
+    response = requests.get(url, timeout=30)
+    return parse_post(response.text)
+
+
+class Page(NamedTuple):
+    url: str
+    status: int
+    # `None` si la página no ha cambiado (304) o no se ha podido descargar
+    text: str | None
+    etag: str | None
+    last_modified: str | None
+    # Motivo del fallo si no se ha podido descargar
+    error: str | None = None
+
+
+class HttpValidators:
+    """
+    `ETag` y `Last-Modified` de las páginas ya ingestadas, guardados en un JSON
+    junto a la BBDD. Si se borra la BBDD se borran con ella y se vuelve a
+    descargar todo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.validators = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.validators = json.load(f)
+
+    def headers(self, url: str) -> dict[str, str]:
+        validator = self.validators.get(url, {})
+        headers = {}
+        if validator.get("etag"):
+            headers["If-None-Match"] = validator["etag"]
+        if validator.get("last_modified"):
+            headers["If-Modified-Since"] = validator["last_modified"]
+        return headers
+
+    def update(self, pages: Iterable[Page]):
+        for page in pages:
+            if page.text is not None:
+                self.validators[page.url] = {
+                    "etag": page.etag,
+                    "last_modified": page.last_modified,
+                }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.validators, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def fetch_pages(
+    urls: Iterable[str],
+    headers: Callable[[str], dict[str, str]] = lambda _: {},
+    max_workers: int = 16,
+    per_host: int = 4,
+    timeout: float = 30,
+    session: requests.Session | None = None,
+) -> Generator[Page, None, None]:
+    """
+    Descarga las URLs en paralelo (como mucho `per_host` peticiones simultáneas
+    a cada host) reutilizando conexiones. `headers(url)` permite enviar
+    cabeceras condicionales: las páginas que no han cambiado llegan como un 304
+    sin cuerpo y se devuelven con `text=None`.
+
+    Una URL que falla (error de red o status >= 400) no detiene el resto: se
+    devuelve como una página con `text=None` y el motivo en `error`.
+
+    Las páginas se devuelven según terminan, no en el orden de `urls`.
+    """
+    session = session or make_session(max_workers)
+    hosts = defaultdict(lambda: threading.Semaphore(per_host))
+    hosts_lock = threading.Lock()
+
+    def fetch(url: str) -> Page:
+        with hosts_lock:
+            host = hosts[urlsplit(url).netloc]
+        try:
+            with host:
+                response = session.get(url, headers=headers(url), timeout=timeout)
+            if response.status_code == 304:
+                return Page(url, 304, None, None, None)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            status = e.response.status_code if e.response is not None else 0
+            return Page(url, status, None, None, None, error=str(e))
+        return Page(
+            url,
+            response.status_code,
+            response.text,
+            response.headers.get("ETag"),
+            response.headers.get("Last-Modified"),
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for future in as_completed([pool.submit(fetch, url) for url in urls]):
+            yield future.result()
+
+
+WORD_RE = re.compile(r"[^\s\.,;:]+")
+
+
+class Chunk(NamedTuple):
+    text: str
+    start: int
+    end: int
+
+
+def read_pieces(
+    doc: str | Iterable[str] | TextIO, read_size: int = 1 << 16
+) -> Generator[str, None, None]:
+    if isinstance(doc, str):
+        yield doc
+    elif hasattr(doc, "read"):
+        while piece := doc.read(read_size):
+            yield piece
+    else:
+        yield from doc
+
+
+def text_splitter(
+    doc: str | Iterable[str] | TextIO, chunk_size: int = 1000, chunk_overlap: int = 200
+) -> Generator[Chunk, None, None]:
     """
     Simple splitter similar a `RecursiveCharacterTextSplitter` de langchain.
     Con leves diferencias: los caracteres de división son más consistentes.
@@ -72,67 +471,553 @@ def text_splitter(doc: str, chunk_size: int = 1000, chunk_overlap: int = 200):
     A pesar de su aparente "complejidad", este es un código que normalmente
     reutilizo o si es necesario para el proyecto mantengo el text splitter de
     langchain.
+
+    Acepta un texto, un iterable de trozos de texto o un fichero, y lo procesa
+    en streaming: solo se mantiene en memoria el chunk actual. Cada chunk es un
+    fragmento literal del texto original con sus posiciones `(start, end)`, lo
+    que permite guardarlas como metadatos y citar la fuente.
     """
-    splits = re.split(r"[\s\.,;:]+", doc)
-
-    # Acumulamos los splits hasta alcanzar el chunk size
-    # añadiento un overlap de `chunk_overlap` caracteres del chunk anterior
-    prev_chunk = ""
-    chunk = ""
-    for subchunk in splits:
-        length = len(chunk) + len(subchunk)
-        if length > chunk_size:
-            yield prev_chunk[-chunk_overlap:] + chunk
-            prev_chunk = chunk
-            chunk = ""
+    # `buf` contiene el texto desde la posición absoluta `buf_start`
+    buf, buf_start = "", 0
+    # Palabras `(start, end)` del chunk actual
+    words: deque[tuple[int, int]] = deque()
+    # Posición absoluta hasta la que se ha procesado el texto
+    scan = 0
+
+    pieces = read_pieces(doc)
+    eof = False
+    while not eof:
+        piece = next(pieces, None)
+        if piece is None:
+            eof = True
+        else:
+            buf += piece
+
+        for match in WORD_RE.finditer(buf, scan - buf_start):
+            if match.end() == len(buf) and not eof:
+                # La palabra puede continuar en el siguiente trozo
+                break
+            word = (buf_start + match.start(), buf_start + match.end())
+            scan = word[1]
+
+            # Acumulamos palabras hasta alcanzar el chunk size. El siguiente
+            # chunk empieza con las últimas palabras del anterior que caben en
+            # `chunk_overlap` caracteres.
+            if words and word[1] - words[0][0] > chunk_size:
+                start, end = words[0][0], words[-1][1]
+                yield Chunk(buf[start - buf_start : end - buf_start], start, end)
+                words.popleft()
+                while words and (
+                    end - words[0][0] > chunk_overlap or word[1] - words[0][0] > chunk_size
+                ):
+                    words.popleft()
+            words.append(word)
         else:
-            chunk += " " + subchunk
-    if chunk:
-        yield chunk
+            scan = buf_start + len(buf)
+
+        # Descartamos el texto que ya no forma parte de ningún chunk
+        cut = min(words[0][0], scan) if words else scan
+        buf, buf_start = buf[cut - buf_start :], cut
+
+    if words:
+        start, end = words[0][0], words[-1][1]
+        yield Chunk(buf[start - buf_start : end - buf_start], start, end)
+
 
+class Record(NamedTuple):
+    id: str
+    document: str
+    metadata: dict
 
-def fill_db(docs: Generator[str, None, None]):
+
+def chunk_id(source: str, offset: int, text: str) -> str:
+    """
+    ID determinista de un chunk: el mismo texto en la misma posición de la
+    misma fuente siempre tiene el mismo ID.
     """
-    Función para llenar la base de datos con los documentos y rellenarla con
-    chunks de los documentos.
+    return hashlib.sha256(f"{source}\0{offset}\0{text}".encode()).hexdigest()
 
-    Para mí el manejo de la BBDD directamente es algo que me ayuda mucho a
-    debuggear y controlar el pipeline: cacheo, reutilización, uso de varios
-    embeddings, etc.
+
+def chunk_records(source: str, doc: str) -> Generator[Record, None, None]:
+    for chunk in text_splitter(doc):
+        yield Record(
+            chunk_id(source, chunk.start, chunk.text),
+            chunk.text,
+            {"source": source, "start": chunk.start, "end": chunk.end},
+        )
+
+
+def batched(
+    records: Iterable[Record], batch_size: int = 100, max_batch_chars: int = 100_000
+) -> Generator[list[Record], None, None]:
     """
-    collection = db.get_or_create_collection(
-        "rag",
-        embedding_function=ef.OpenAIEmbeddingFunction(
+    Agrupa los chunks en lotes de como mucho `batch_size` elementos y
+    `max_batch_chars` caracteres (la API de embeddings limita el tamaño de cada
+    petición).
+    """
+    batch, chars = [], 0
+    for record in records:
+        size = len(record.document)
+        if batch and (len(batch) >= batch_size or chars + size > max_batch_chars):
+            yield batch
+            batch, chars = [], 0
+        batch.append(record)
+        chars += size
+    if batch:
+        yield batch
+
+
+def ingest(
+    collection,
+    embedding_function,
+    records: Iterable[Record],
+    batch_size: int = 100,
+    max_workers: int = 4,
+    max_retries: int = 3,
+) -> int:
+    """
+    Añade los chunks a la colección por lotes.
+
+    Cada lote se convierte en una única llamada a la API de embeddings y en un
+    único `collection.add`. Los embeddings de hasta `max_workers` lotes se
+    calculan en paralelo, pero las escrituras se hacen desde este hilo.
+
+    Un lote solo se escribe cuando tiene todos sus embeddings. Si un lote falla
+    tras `max_retries` intentos se eliminan los lotes ya escritos en esta
+    llamada, para que la siguiente ejecución no vea una colección a medias.
+    """
+
+    def embed_batch(batch: list[Record]):
+        documents = [record.document for record in batch]
+        for attempt in range(max_retries):
+            try:
+                return embedding_function(documents)
+            except Exception:
+                if attempt == max_retries - 1:
+                    raise
+                time.sleep(2**attempt)
+
+    start = time.perf_counter()
+    written_ids, total = [], 0
+    batches = batched(records, batch_size)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}
+        try:
+            while True:
+                # Mantenemos como mucho `2 * max_workers` lotes en vuelo para no
+                # cargar todos los chunks en memoria
+                for batch in batches:
+                    pending[pool.submit(embed_batch, batch)] = batch
+                    if len(pending) >= 2 * max_workers:
+                        break
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = pending.pop(future)
+                    ids = [record.id for record in batch]
+                    collection.add(
+                        ids=ids,
+                        documents=[record.document for record in batch],
+                        metadatas=[record.metadata for record in batch],
+                        embeddings=future.result(),
+                    )
+                    written_ids.extend(ids)
+                    total += len(batch)
+        except Exception:
+            for future in pending:
+                future.cancel()
+            if written_ids:
+                collection.delete(ids=written_ids)
+            raise
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"Ingestados {total} chunks en {elapsed:.1f}s "
+        f"({total / elapsed if elapsed else 0:.1f} chunks/s)",
+        file=sys.stderr,
+    )
+    return total
+
+
+def legacy_ids(collection) -> list[str]:
+    """
+    IDs de los chunks guardados por versiones anteriores de `fill_db`, con IDs
+    `uuid4` y sin metadatos. No pertenecen a ninguna fuente, así que
+    `sync_db` nunca los encontraría al comparar por `source`.
+    """
+    result = collection.get(include=["metadatas"])
+    return [
+        id
+        for id, metadata in zip(result["ids"], result["metadatas"])
+        if not metadata or "source" not in metadata
+    ]
+
+
+def sync_db(
+    collection,
+    embedding_function,
+    docs: Iterable[tuple[str, str]],
+    lexical: BM25Index | None = None,
+) -> int:
+    """
+    Sincroniza la colección con las fuentes `(url, texto)`: añade los chunks
+    nuevos, borra los que ya no existen y no toca los que no han cambiado.
+
+    Solo se consideran las fuentes recibidas; el resto de la colección se deja
+    como está, salvo los chunks sin `source` de versiones anteriores
+    (`legacy_ids`), que se borran la primera vez que se sincroniza la colección
+    en cada proceso. Si se pasa un índice léxico se actualiza con los mismos
+    cambios.
+    """
+    new_records, stale_ids = [], []
+    if id(collection) not in legacy_checked:
+        stale_ids.extend(legacy_ids(collection))
+        legacy_checked.add(id(collection))
+    for source, doc in docs:
+        records = {record.id: record for record in chunk_records(source, doc)}
+        existing = set(collection.get(where={"source": source}, include=[])["ids"])
+        new_records.extend(r for id, r in records.items() if id not in existing)
+        stale_ids.extend(existing - records.keys())
+
+    added = ingest(collection, embedding_function, new_records) if new_records else 0
+    if stale_ids:
+        collection.delete(ids=stale_ids)
+    if lexical is not None:
+        lexical.add(
+            [r.id for r in new_records],
+            [r.document for r in new_records],
+            [r.metadata for r in new_records],
+        )
+        lexical.delete(stale_ids)
+    if added or stale_ids:
+        # Nueva revisión: invalida las respuestas cacheadas (`answer_cache`)
+        collection.modify(metadata={"revision": uuid4().hex})
+    print(f"Sincronizados: {added} añadidos, {len(stale_ids)} borrados", file=sys.stderr)
+    return added
+
+
+@cache
+def openai_embedding_function():
+    return CachedEmbeddingFunction(
+        ef.OpenAIEmbeddingFunction(
             model_name="text-embedding-ada-002", api_key=os.getenv("OPENAI_API_KEY")
         ),
+        EmbeddingCache("./embeddingcache", "text-embedding-ada-002"),
     )
 
-    if collection.count() > 0:
-        # Si ya existe la base de datos, se salta la creación para ahorrar
-        # tiempo (y dinero).
-        return collection
 
-    for doc in docs:
-        for chunk in text_splitter(doc):
-            collection.add(documents=chunk, ids=[uuid4().hex])
+@cache
+def get_collection(backend: str = BACKEND):
+    """
+    Colección `rag` en el backend elegido. Ambos backends exponen la misma API
+    (`add`, `get`, `delete`, `query`, `count`).
+    """
+    if backend == "numpy":
+        return NumpyIndex(
+            STORE_PATHS["numpy"],
+            embedding_function=openai_embedding_function(),
+            dtype=os.getenv("RAG_VECTOR_DTYPE", "float32"),
+            rerank=int(os.getenv("RAG_RERANK", 0)),
+        )
+    if backend == "chroma":
+        return db.get_or_create_collection(
+            "rag", embedding_function=openai_embedding_function()
+        )
+    raise ValueError(f"Backend desconocido: {backend}")
+
+
+def fill_db(docs: Iterable[tuple[str, str]], backend: str = BACKEND):
+    """
+    Función para llenar la base de datos con los documentos `(url, texto)` y
+    rellenarla con chunks de los documentos.
+
+    Para mí el manejo de la BBDD directamente es algo que me ayuda mucho a
+    debuggear y controlar el pipeline: cacheo, reutilización, uso de varios
+    embeddings, etc.
+    """
+    collection = get_collection(backend)
+
+    # Si ya existe la base de datos solo se calculan los embeddings de los
+    # chunks que han cambiado para ahorrar tiempo (y dinero).
+    sync_db(collection, openai_embedding_function(), docs, lexical_indexes.get(backend))
 
     return collection
 
 
-def chatbot(question: str):
+def lexical_index(backend: str = BACKEND) -> BM25Index:
     """
-    Función central de nuestro chatbot. Equivale al pipeline de LangChain.
+    Índice BM25 de la colección. Se construye la primera vez que se usa con los
+    chunks ya guardados y después `sync_db` lo mantiene actualizado.
     """
-    db = fill_db([scrape_web("https://lilianweng.github.io/posts/2023-06-23-agent/")])
-    context = db.query(query_texts=[question], n_results=5)["documents"][0]
-    return llm(prompt(context, question))
+    if backend not in lexical_indexes:
+        lexical_indexes[backend] = BM25Index.from_collection(get_collection(backend))
+    return lexical_indexes[backend]
+
+
+def retrieve(
+    questions: list[str],
+    backend: str = BACKEND,
+    retrieval: str = RETRIEVAL,
+    n_results: int = 10,
+    embeddings: list | None = None,
+) -> list[tuple[list[str], list[dict]]]:
+    """
+    Chunks `(documentos, metadatos)` más relevantes para cada pregunta:
+
+    - `vector`: búsqueda por embeddings en la colección
+    - `lexical`: BM25 en memoria, sin llamadas a la red
+    - `hybrid`: ambas combinadas con Reciprocal Rank Fusion
+    """
+    if retrieval not in ("vector", "lexical", "hybrid"):
+        raise ValueError(f"Modo de búsqueda desconocido: {retrieval}")
+
+    results = []
+    if retrieval in ("vector", "hybrid"):
+        db = get_collection(backend)
+        if embeddings is None:
+            results.append(db.query(query_texts=questions, n_results=n_results))
+        else:
+            results.append(db.query(query_embeddings=embeddings, n_results=n_results))
+    if retrieval in ("lexical", "hybrid"):
+        results.append(lexical_index(backend).query(questions, n_results))
+
+    if len(results) == 1:
+        return list(zip(results[0]["documents"], results[0]["metadatas"]))
+
+    fused = []
+    for i in range(len(questions)):
+        chunks = {
+            id: (document, metadata)
+            for result in results
+            for id, document, metadata in zip(
+                result["ids"][i], result["documents"][i], result["metadatas"][i]
+            )
+        }
+        ids = reciprocal_rank_fusion(*(result["ids"][i] for result in results))
+        chunks = [chunks[id] for id in ids[:n_results]]
+        fused.append(([c[0] for c in chunks], [c[1] for c in chunks]))
+    return fused
+
+
+def crawl(urls: Iterable[str], backend: str = BACKEND):
+    """
+    Descarga las URLs y sincroniza la colección solo con las páginas que han
+    cambiado desde la última vez. Los validadores HTTP se guardan después de
+    sincronizar, así un fallo en la ingesta no marca una página como ingestada.
+    Las páginas que no se pueden descargar se avisan por stderr y se vuelven a
+    intentar en la siguiente ejecución.
+    """
+    validators = HttpValidators(os.path.join(STORE_PATHS[backend], "httpcache.json"))
+    pages = []
+    for page in fetch_pages(urls, validators.headers):
+        if page.error is not None:
+            print(f"No se ha podido descargar {page.url}: {page.error}", file=sys.stderr)
+        elif page.text is not None:
+            pages.append(page)
+    htmls = [page.text for page in pages]
+    # Con muchas páginas compensa repartir el parseo entre procesos
+    texts = parse_posts(htmls) if len(htmls) >= 32 else [parse_post(h) for h in htmls]
+    collection = fill_db([(page.url, text) for page, text in zip(pages, texts)], backend)
+    validators.update(pages)
+    return collection
 
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        question = sys.argv[1]
+@cache
+def warm_up(backend: str = BACKEND):
+    """
+    Prepara el corpus una única vez por proceso (descarga, sincronización y
+    apertura de la colección). Las siguientes llamadas devuelven la misma
+    colección sin hacer nada más.
+    """
+    return crawl(URLS, backend)
+
+
+def stored_revision(backend: str = BACKEND) -> str | None:
+    """
+    Revisión de la colección tal y como está guardada, no la de la colección
+    que `warm_up` mantiene abierta: si otro proceso (por ejemplo el refresco
+    nocturno) sincroniza, las respuestas cacheadas dejan de valer. Se lee como
+    mucho una vez cada `REVISION_CHECK_INTERVAL` segundos.
+    """
+    now = time.monotonic()
+    checked = revision_checks.get(backend)
+    if checked is not None and now - checked[0] < REVISION_CHECK_INTERVAL:
+        return checked[1]
+    if backend == "numpy":
+        metadata = get_collection(backend).stored_metadata()
     else:
-        question = "What is Task Decomposition?"
+        metadata = db.get_collection(
+            "rag", embedding_function=openai_embedding_function()
+        ).metadata
+    revision = (metadata or {}).get("revision")
+    revision_checks[backend] = (now, revision)
+    return revision
+
+
+@contextmanager
+def timed(timings: dict[str, float] | None, stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+
+
+def chatbot(
+    question: str,
+    backend: str = BACKEND,
+    timings: dict[str, float] | None = None,
+    n_results: int = 10,
+    token_budget: int = 1000,
+    stream: bool = False,
+    retrieval: str = RETRIEVAL,
+):
+    """
+    Función central de nuestro chatbot. Equivale al pipeline de LangChain.
+
+    Por pregunta solo se hace la búsqueda y la generación: el corpus se prepara
+    en `warm_up` la primera vez. Si se pasa `timings` se rellena con el tiempo
+    (en segundos) de cada etapa.
+
+    Antes de buscar se consulta `answer_cache`: si ya hemos respondido una
+    pregunta casi idéntica con la misma revisión de la colección (la guardada,
+    ver `stored_revision`) y la misma configuración de búsqueda (`backend`,
+    `retrieval`, `n_results`, `token_budget`) se devuelve esa respuesta.
+
+    Con `stream=True` devuelve un generador con el texto de la respuesta según
+    llega (ver `print_stream`).
 
+    `retrieval` elige la búsqueda (ver `retrieve`). En modo `lexical` no se
+    calcula el embedding de la pregunta, así que tampoco se usa la caché.
+    """
+    with timed(timings, "warm_up"):
+        warm_up(backend)
+    embedding, revision = None, None
+    scope = (backend, retrieval, n_results, token_budget)
+    if retrieval != "lexical":
+        with timed(timings, "cache"):
+            revision = stored_revision(backend)
+            embedding = openai_embedding_function()([question])[0]
+            answer = answer_cache.lookup(embedding, revision, scope)
+            if answer is not None:
+                return iter([answer]) if stream else answer
+    with timed(timings, "retrieval"):
+        [(documents, metadatas)] = retrieve(
+            [question],
+            backend,
+            retrieval,
+            n_results,
+            None if embedding is None else [embedding],
+        )
+        context = pack_context(documents, metadatas, token_budget)
+
+    if stream:
+        return stream_answer(
+            prompt(context, question), embedding, question, revision, scope
+        )
+    with timed(timings, "generation"):
+        answer = llm(prompt(context, question))
+    if embedding is not None:
+        answer_cache.store(embedding, question, answer, revision, scope)
+    return answer
+
+
+def stream_answer(
+    prompt: str, embedding, question: str, revision, scope: tuple
+) -> Generator[str, None, None]:
+    deltas = []
+    for delta in llm_stream(prompt):
+        deltas.append(delta)
+        yield delta
+    # Solo se cachean las respuestas completas
+    if embedding is not None:
+        answer_cache.store(embedding, question, "".join(deltas), revision, scope)
+
+
+def read_questions(source: TextIO) -> Generator[str, None, None]:
+    """
+    Una pregunta por línea: texto plano o JSON (`{"question": "..."}`).
+    """
+    for line in source:
+        line = line.strip()
+        if line.startswith("{"):
+            yield json.loads(line)["question"]
+        elif line:
+            yield line
+
+
+def chatbot_batch(
+    questions: list[str],
+    backend: str = BACKEND,
+    max_workers: int = 8,
+    n_results: int = 10,
+    token_budget: int = 1000,
+    retrieval: str = RETRIEVAL,
+) -> Generator[dict, None, None]:
+    """
+    Responde a muchas preguntas en un mismo proceso. Los embeddings de todas
+    las preguntas se calculan en una única `db.query` y las llamadas a la LLM
+    se hacen en paralelo (como mucho `max_workers` a la vez).
+
+    Los resultados se devuelven en el orden de entrada según van estando
+    listos. `retrieval` es el tiempo de la búsqueda de todo el lote.
+    """
+    timings = {}
+    with timed(timings, "warm_up"):
+        warm_up(backend)
+    with timed(timings, "retrieval"):
+        contexts = [
+            pack_context(documents, metadatas, token_budget)
+            for documents, metadatas in retrieve(
+                questions, backend, retrieval, n_results
+            )
+        ]
+
+    def answer(item: tuple[str, list[str]]) -> dict:
+        question, context = item
+        result = {"question": question, "timings": dict(timings)}
+        try:
+            with timed(result["timings"], "generation"):
+                result["answer"] = llm(prompt(context, question))
+        except Exception as e:
+            result["error"] = repr(e)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        yield from pool.map(answer, zip(questions, contexts))
+
+
+def print_timings(timings: dict[str, float]):
+    print(
+        "Tiempos: " + ", ".join(f"{k} {v * 1000:.0f} ms" for k, v in timings.items()),
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--batch"]:
+        # python -m solved.rag.v2 --batch [preguntas.jsonl | -]
+        path = sys.argv[2] if len(sys.argv) > 2 else "-"
+        with nullcontext(sys.stdin) if path == "-" else open(path) as source:
+            questions = list(read_questions(source))
+        for result in chatbot_batch(questions):
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+        sys.exit()
+
+    # python -m solved.rag.v2 [--stream] [pregunta]
+    stream = "--stream" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg != "--stream"]
+    question = args[0] if args else "What is Task Decomposition?"
+
+    timings = {}
     print(f"Human: {question}")
-    print(f"Chatbot: {chatbot(question)}")
+    if stream:
+        start = time.perf_counter()
+        print("Chatbot: ", end="")
+        print_stream(chatbot(question, timings=timings, stream=True), timings, start)
+    else:
+        print(f"Chatbot: {chatbot(question, timings=timings)}")
+    print_timings(timings)
@@ -5,9 +5,39 @@ componentes:
 - generación de ideas ('idea_prompt')
 - crítica de ideas ('critique_prompt')
 - combinación final ('merge_prompt')
+
+Extra:
+- Las ideas se generan en paralelo (como mucho `max_concurrency` peticiones a
+  la vez), así la latencia es la de una idea y no la de `n_ideas` seguidas
+- Los prompts forman una conversación que solo crece por el final
+  (`critique_messages`, `merge_messages`): cada etapa comparte el prefijo de la
+  anterior y el proveedor puede cachearlo. Se registran los tokens de cada
+  etapa (`StageUsage`)
+- Muchas preguntas a la vez (`smartllm_batch`, `--batch`): cada etapa de cada
+  pregunta se lanza en cuanto sus dependencias terminan, con un único límite
+  global de peticiones en vuelo
+- Modo adaptativo (`adaptive=True`, `--adaptive`): si las ideas llegan a la
+  misma respuesta final (`agreement`) se devuelve la más representativa sin
+  crítica ni combinación; si discrepan se piden más ideas (hasta `max_ideas`)
+  antes de criticarlas. `path_stats` cuenta cada camino y las llamadas por
+  pregunta
+- La respuesta final se puede mostrar en streaming (`--stream`): las ideas y la
+  crítica se necesitan completas, pero la combinación final se imprime según
+  llega
 """
 
+import heapq
+import json
+import re
 import sys
+import threading
+import time
+import unicodedata
+from collections import Counter
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import count
+from typing import Generator, Iterable, NamedTuple, TextIO
 from openai import OpenAI
 from dotenv import load_dotenv
 load_dotenv()
@@ -17,30 +47,92 @@ client = OpenAI()
 DEFAULT = """¿Cuál es el sentido de la vida?"""
 
 
-def llm(prompt: str, model: str = "gpt-3.5-turbo") -> str:
-    response = client.chat.completions.create(
-        model=model, messages=[{"role": "user", "content": prompt}]
+class StageUsage(NamedTuple):
+    stage: str
+    input: int
+    cached: int
+    output: int
+
+
+def record_usage(usage: list[StageUsage] | None, stage: str, response_usage):
+    if usage is None or response_usage is None:
+        return
+    details = getattr(response_usage, "prompt_tokens_details", None)
+    usage.append(
+        StageUsage(
+            stage,
+            response_usage.prompt_tokens,
+            getattr(details, "cached_tokens", None) or 0,
+            response_usage.completion_tokens,
+        )
     )
+
+
+def chat(
+    messages: list[dict],
+    model: str = "gpt-3.5-turbo",
+    stage: str = "",
+    usage: list[StageUsage] | None = None,
+) -> str:
+    response = client.chat.completions.create(model=model, messages=messages)
+    record_usage(usage, stage, response.usage)
     return response.choices[0].message.content
 
 
+def chat_stream(
+    messages: list[dict],
+    model: str = "gpt-3.5-turbo",
+    stage: str = "",
+    usage: list[StageUsage] | None = None,
+) -> Generator[str, None, None]:
+    stream = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    try:
+        for event in stream:
+            if event.choices and event.choices[0].delta.content:
+                yield event.choices[0].delta.content
+            # El último evento no tiene `choices`, solo el uso de tokens
+            record_usage(usage, stage, event.usage)
+    finally:
+        stream.close()
+
+
+def print_stream(deltas: Iterable[str], start: float | None = None) -> str:
+    """
+    Imprime los deltas según llegan y muestra el tiempo hasta el primer token y
+    el total, medidos desde `start` (por defecto, desde ahora).
+    """
+    start, text, ttft = start or time.perf_counter(), [], None
+    for delta in deltas:
+        ttft = ttft or time.perf_counter() - start
+        print(delta, end="", flush=True)
+        text.append(delta)
+    print()
+    total = time.perf_counter() - start
+    print(f"TTFT {ttft or total:.2f}s, total {total:.2f}s", file=sys.stderr)
+    return "".join(text)
+
+
 def idea_prompt(question: str) -> str:
     return f"""Question: {question}
 Answer: Let's work this out in a step by step way to be sure we have the right answer:
 """
 
-def critique_prompt(question: str, ideas: list[str]) -> str:
-    return f"""{idea_prompt(question)}
-{'\n'.join(f"> Idea {i+1}: {idea}" for i, idea in enumerate(ideas))}
-You are a researcher tasked with investigating the 2 response options provided.
+
+def critique_prompt(ideas: list[str]) -> str:
+    return f"""{'\n'.join(f"> Idea {i+1}: {idea}" for i, idea in enumerate(ideas))}
+You are a researcher tasked with investigating the {len(ideas)} response options provided.
 List the flaws and faulty logic of each answer option. Let's work this out in a
 step by step way to be sure we have all the errors:
 """
 
-def merge_prompt(question: str, ideas: list[str], critique: str) -> str:
-    return f"""{critique_prompt(question, ideas)}
-{critique}
-You are a resolver tasked with 1) finding which of the 2 answer
+
+def merge_prompt(n_ideas: int = 2) -> str:
+    return f"""You are a resolver tasked with 1) finding which of the {n_ideas} answer
 options the researcher thought was  best, 2) improving that answer and
 3) printing the answer in full. Don't output anything for step 1 or 2,
 only the full answer in 3. Let's work this out in a step by step way to be
@@ -48,12 +140,444 @@ sure we have the right answer:
 """
 
 
-def smartllm(question: str = DEFAULT, n_ideas: int = 2):
-    ideas = [llm(idea_prompt(question)) for _ in range(n_ideas)]
-    critique = llm(critique_prompt(question, ideas))
-    return llm(merge_prompt(question, ideas, critique))
+def critique_messages(question: str, ideas: list[str]) -> list[dict]:
+    """
+    La cadena es una conversación que solo crece por el final: cada etapa
+    reenvía exactamente los mensajes de la anterior (mismo prefijo) y añade
+    los suyos, así el proveedor puede reutilizar el prefijo cacheado.
+    """
+    return [
+        {"role": "user", "content": idea_prompt(question)},
+        {"role": "user", "content": critique_prompt(ideas)},
+    ]
+
+
+def merge_messages(question: str, ideas: list[str], critique: str) -> list[dict]:
+    return [
+        *critique_messages(question, ideas),
+        {"role": "assistant", "content": critique},
+        {"role": "user", "content": merge_prompt(len(ideas))},
+    ]
+
+
+def generate_ideas(
+    question: str,
+    n_ideas: int,
+    max_concurrency: int = 4,
+    model: str = "gpt-3.5-turbo",
+    usage: list[StageUsage] | None = None,
+) -> list[str]:
+    """
+    Genera las ideas en paralelo. `map` mantiene el orden, así que "Idea 1" es
+    siempre la primera petición.
+    """
+    messages = [{"role": "user", "content": idea_prompt(question)}]
+    with ThreadPoolExecutor(max_workers=min(n_ideas, max_concurrency)) as pool:
+        return list(
+            pool.map(lambda _: chat(messages, model, "idea", usage), range(n_ideas))
+        )
+
+
+WORD_RE = re.compile(r"\d+(?:[.,]\d+)*|\w+")
+NUMBER_RE = re.compile(r"\d+(?:[.,]\d+)*")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n+")
+
+# Palabras sin contenido (inglés y español). "yes, X" dice lo mismo que "X";
+# las negaciones no están aquí, se tratan aparte (`NEGATIONS`)
+STOP_WORDS = frozenset(
+    """
+    a about after all also an and any are as at be because been before being
+    but by can could did do does each finally first for from had has have he
+    her his how i if in into is it its let lets me more most my now of on one
+    or other our out s so step such sure t than that the their them then there
+    therefore these they this thus to up us was way we were what when where
+    which while who why will with would yes you your
+    al como con de del el en es esta este la las lo los más o para pero por
+    que se si sin su sus un una y
+    """.split()
+)
+
+# Frases de cortesía del final ("I hope this helps!"): no son la respuesta
+BOILERPLATE_RE = re.compile(
+    r"hope (this|that|it) helps|let me know|feel free|happy to help|glad to help"
+    r"|good luck|(any|more|other|further) questions|espero que (te )?(sirva|ayude)"
+    r"|no dudes|cualquier (otra )?(duda|pregunta)",
+    re.IGNORECASE,
+)
+# "The answer is X", "Final answer: X", "La respuesta es X"
+ANSWER_RE = re.compile(
+    r"\b(?:final answer|answer|result|respuesta|resultado)\b"
+    r"\s*(?:is|would be|será|es|:|=)\s*(.+)",
+    re.IGNORECASE,
+)
+# "..., so the capital is Canberra": nos quedamos con lo que va detrás del
+# último conector
+CONCLUSION_RE = re.compile(
+    r".*\b(?:so|therefore|thus|hence|in conclusion|por lo tanto|por tanto|así que)\b"
+    r",?\s*(.+)",
+    re.IGNORECASE,
+)
+STEP_RE = re.compile(r"\b(?:step|paso) \d+\s*:?", re.IGNORECASE)
+CLAUSE_RE = re.compile(r"[;:()]|,\s")
+# Niegan el siguiente término con contenido de la misma cláusula
+NEGATIONS = frozenset(
+    "not no never nor cannot isn aren wasn weren don doesn didn nunca ni".split()
+)
+
+
+class Answer(NamedTuple):
+    terms: frozenset[str]
+    # En orden de aparición: el resultado suele ser el último
+    numbers: tuple[str, ...]
+
+
+def normalize_number(number: str) -> str:
+    if re.fullmatch(r"\d{1,3}(,\d{3})+", number):
+        number = number.replace(",", "")
+    return f"{float(number.replace(',', '.')):g}"
+
+
+def normalize_word(word: str) -> str:
+    word = unicodedata.normalize("NFKD", word)
+    word = "".join(c for c in word if not unicodedata.combining(c))
+    # Plural inglés/español muy simple: "fruits" y "fruit" son el mismo término
+    if len(word) > 4 and word.endswith(("oes", "xes", "ches", "shes")):
+        word = word[:-2]
+    elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    return word
+
+
+def final_answer(text: str) -> str:
+    """
+    El fragmento donde está la respuesta: lo que sigue a la última frase que
+    la anuncia ("the answer is ...") o, si no hay ninguna, la última frase con
+    contenido desde su último conector ("so", "therefore"...). Las frases de
+    cortesía y las preguntas del final no cuentan.
+    """
+    sentences = [
+        sentence
+        for sentence in map(str.strip, SENTENCE_RE.split(STEP_RE.sub("", text)))
+        if sentence
+        and not sentence.endswith("?")
+        and not BOILERPLATE_RE.search(sentence)
+    ]
+    for sentence in reversed(sentences):
+        if match := ANSWER_RE.search(sentence):
+            return match.group(1)
+    if not sentences:
+        return text
+    if match := CONCLUSION_RE.match(sentences[-1]):
+        return match.group(1)
+    return sentences[-1]
+
+
+def extract_answer(text: str) -> Answer:
+    """
+    Respuesta normalizada de una idea (`final_answer`): sus números y sus
+    términos con contenido sin tildes, mayúsculas ni plurales. Un término
+    negado ("not Sydney") es distinto del término ("Sydney").
+    """
+    terms, numbers = set(), []
+    for clause in CLAUSE_RE.split(final_answer(text).lower()):
+        negated = False
+        for word in WORD_RE.findall(clause):
+            if NUMBER_RE.fullmatch(word):
+                numbers.append(normalize_number(word))
+            elif word in NEGATIONS:
+                negated = True
+            elif word not in STOP_WORDS:
+                word = normalize_word(word)
+                terms.add(f"not {word}" if negated else word)
+                negated = False
+        if negated:
+            terms.add("not")
+    return Answer(frozenset(terms), tuple(numbers))
+
+
+def answers_agree(a: Answer, b: Answer) -> float:
+    """
+    Acuerdo entre dos respuestas normalizadas, entre 0 y 1:
+
+    - Si ambas tienen números, deciden los últimos (el resultado): "boils at
+      100 C" y "boils at 90 C" comparten casi todo salvo lo que importa
+    - Si no, proporción de términos de la respuesta más corta que están en la
+      otra: una reformulación que solo añade palabras ("The capital of
+      Australia is Canberra" frente a "the capital is Canberra") cuenta como
+      acuerdo, y un término distinto en cada una ("Canberra"/"Sydney") no
+    """
+    if a.numbers and b.numbers:
+        return float(a.numbers[-1] == b.numbers[-1])
+    if not a.terms or not b.terms:
+        return 0.0
+    return len(a.terms & b.terms) / min(len(a.terms), len(b.terms))
+
+
+def agreement(ideas: list[str]) -> tuple[float, str]:
+    """
+    Devuelve el acuerdo entre las ideas (el menor entre dos de ellas) y la
+    idea más representativa (la que más acuerdo tiene con el resto).
+
+    Solo se compara la respuesta final de cada idea (`extract_answer`), no el
+    razonamiento: dos formas distintas de llegar al mismo resultado coinciden
+    y un razonamiento casi idéntico con otro resultado no. No hace llamadas a
+    la API.
+    """
+    answers = [extract_answer(idea) for idea in ideas]
+    pairs = {
+        (i, j): answers_agree(answers[i], answers[j])
+        for i in range(len(ideas))
+        for j in range(i + 1, len(ideas))
+    }
+    if not pairs:
+        return 1.0, ideas[0]
+    support = [
+        sum(value for pair, value in pairs.items() if i in pair) for i in range(len(ideas))
+    ]
+    return min(pairs.values()), ideas[support.index(max(support))]
+
+
+# Preferimos pagar una crítica de más a devolver una respuesta que otra idea
+# contradice: con respuestas de 3-6 términos basta un término distinto en cada
+# una para no llegar (ver `tests/test_smartllm_agreement.py`)
+AGREEMENT_THRESHOLD = 0.85
+
+
+class PathStats(Counter):
+    """
+    Cuenta cuántas preguntas siguen cada camino (`full`, `agree`, `critique`,
+    `escalated`) y las llamadas a la LLM que han hecho.
+    """
+
+    lock = threading.Lock()
+
+    @property
+    def calls_per_question(self) -> float:
+        return self["calls"] / self["questions"] if self["questions"] else 0.0
+
+    def record(self, path: str, calls: int):
+        with self.lock:
+            self[path] += 1
+            self["questions"] += 1
+            self["calls"] += calls
+
+
+path_stats = PathStats()
+
+
+def smartllm(
+    question: str = DEFAULT,
+    n_ideas: int = 2,
+    stream: bool = False,
+    max_concurrency: int = 4,
+    model: str = "gpt-3.5-turbo",
+    usage: list[StageUsage] | None = None,
+    adaptive: bool = False,
+    threshold: float = AGREEMENT_THRESHOLD,
+    max_ideas: int = 4,
+):
+    """
+    Con `stream=True` devuelve un generador con los deltas de la respuesta final.
+
+    Si se pasa `usage` se añaden los tokens de entrada, de entrada cacheados
+    y de salida de cada llamada. El cacheo de prefijos lo hace el proveedor
+    automáticamente en los modelos que lo soportan (por ejemplo `gpt-4o-mini`)
+    a partir de 1024 tokens de prefijo común.
+
+    Con `adaptive=True`, si el acuerdo entre las ideas llega a `threshold` se
+    devuelve la más representativa; si no, se completan hasta `max_ideas`
+    ideas antes de la crítica.
+    """
+    ideas = generate_ideas(question, n_ideas, max_concurrency, model, usage)
+    path = "full"
+    if adaptive:
+        score, best = agreement(ideas)
+        if score >= threshold:
+            path_stats.record("agree", len(ideas))
+            return iter([best]) if stream else best
+        path = "critique"
+        if len(ideas) < max_ideas:
+            path = "escalated"
+            ideas += generate_ideas(
+                question, max_ideas - len(ideas), max_concurrency, model, usage
+            )
+    path_stats.record(path, len(ideas) + 2)
+    critique = chat(critique_messages(question, ideas), model, "critique", usage)
+    messages = merge_messages(question, ideas, critique)
+    if stream:
+        return chat_stream(messages, model, "merge", usage)
+    return chat(messages, model, "merge", usage)
+
+
+# Con varias etapas listas se lanzan antes las que acercan una pregunta a su
+# final: así las respuestas salen de forma continua y no todas al final
+STAGE_PRIORITY = {"merge": 0, "critique": 1, "idea": 2}
+
+
+def smartllm_batch(
+    questions: list[str],
+    n_ideas: int = 2,
+    max_concurrency: int = 8,
+    model: str = "gpt-3.5-turbo",
+    usage: list[StageUsage] | None = None,
+    adaptive: bool = False,
+    threshold: float = AGREEMENT_THRESHOLD,
+    max_ideas: int = 4,
+) -> Generator[dict, None, None]:
+    """
+    Ejecuta `smartllm` sobre muchas preguntas. Cada pregunta es un pequeño
+    grafo (`n_ideas` ideas -> crítica -> combinación) y un planificador lanza
+    las etapas listas de todas las preguntas con, como mucho,
+    `max_concurrency` llamadas en vuelo. El rendimiento lo limita el rate
+    limit de la API y no la latencia de tres etapas seguidas por pregunta.
+
+    Los resultados se devuelven según terminan, con `index` (posición en
+    `questions`) para poder reordenarlos. Si una etapa falla la pregunta se
+    devuelve con `error` y se descartan sus etapas pendientes.
+
+    `adaptive`, `threshold` y `max_ideas` funcionan igual que en `smartllm`;
+    cada resultado indica el camino seguido en `path`.
+    """
+    ideas = [[None] * n_ideas for _ in questions]
+    missing_ideas = [n_ideas] * len(questions)
+    critiques = [None] * len(questions)
+    paths = ["full"] * len(questions)
+    failed = set()
+    ready, order = [], count()
+
+    def push(stage: str, q: int, i: int = 0):
+        heapq.heappush(ready, (STAGE_PRIORITY[stage], next(order), stage, q, i))
+
+    def run(stage: str, q: int, i: int) -> str:
+        question = questions[q]
+        if stage == "idea":
+            messages = [{"role": "user", "content": idea_prompt(question)}]
+        elif stage == "critique":
+            messages = critique_messages(question, ideas[q])
+        else:
+            messages = merge_messages(question, ideas[q], critiques[q])
+        return chat(messages, model, stage, usage)
+
+    for q in range(len(questions)):
+        for i in range(n_ideas):
+            push("idea", q, i)
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        while ready or running:
+            while ready and len(running) < max_concurrency:
+                _, _, stage, q, i = heapq.heappop(ready)
+                if q not in failed:
+                    running[pool.submit(run, stage, q, i)] = (stage, q, i)
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, q, i = running.pop(future)
+                if q in failed:
+                    continue
+                try:
+                    text = future.result()
+                except Exception as e:
+                    failed.add(q)
+                    yield {"index": q, "question": questions[q], "error": repr(e)}
+                    continue
+                result = {"index": q, "question": questions[q]}
+                if stage == "idea":
+                    ideas[q][i] = text
+                    missing_ideas[q] -= 1
+                    if missing_ideas[q]:
+                        continue
+                    if not adaptive or paths[q] != "full":
+                        push("critique", q)
+                        continue
+                    score, best = agreement(ideas[q])
+                    if score >= threshold:
+                        path_stats.record("agree", len(ideas[q]))
+                        yield {**result, "answer": best, "path": "agree"}
+                    elif len(ideas[q]) < max_ideas:
+                        paths[q] = "escalated"
+                        extra = max_ideas - len(ideas[q])
+                        ideas[q] += [None] * extra
+                        missing_ideas[q] = extra
+                        for i in range(len(ideas[q]) - extra, len(ideas[q])):
+                            push("idea", q, i)
+                    else:
+                        paths[q] = "critique"
+                        push("critique", q)
+                elif stage == "critique":
+                    critiques[q] = text
+                    push("merge", q)
+                else:
+                    path_stats.record(paths[q], len(ideas[q]) + 2)
+                    yield {**result, "answer": text, "path": paths[q]}
+
+
+def read_questions(source: TextIO) -> Generator[str, None, None]:
+    """
+    Una pregunta por línea: texto plano o JSON (`{"question": "..."}`).
+    """
+    for line in source:
+        line = line.strip()
+        if line.startswith("{"):
+            yield json.loads(line)["question"]
+        elif line:
+            yield line
+
+
+def print_path_stats():
+    paths = ", ".join(
+        f"{path} {path_stats[path]}" for path in ("full", "agree", "critique", "escalated")
+    )
+    print(
+        f"{paths}; {path_stats.calls_per_question:.2f} llamadas por pregunta",
+        file=sys.stderr,
+    )
+
+
+def print_usage(usage: list[StageUsage]):
+    for stage in usage:
+        print(
+            f"{stage.stage:>8}: {stage.input} entrada ({stage.cached} cacheados), "
+            f"{stage.output} salida",
+            file=sys.stderr,
+        )
 
 
 if __name__ == "__main__":
-    question = sys.argv[1] if len(sys.argv) > 1 else DEFAULT
-    print(smartllm(question))
\ No newline at end of file
+    flags = {"--stream", "--adaptive"}
+    adaptive = "--adaptive" in sys.argv
+    args = [arg for arg in sys.argv[1:] if arg not in flags]
+
+    if args[:1] == ["--batch"]:
+        # python -m solved.smartllm.v2 --batch [--adaptive] [preguntas.jsonl | -]
+        path = args[1] if len(args) > 1 else "-"
+        with nullcontext(sys.stdin) if path == "-" else open(path) as source:
+            questions = list(read_questions(source))
+        start = time.perf_counter()
+        for result in smartllm_batch(questions, adaptive=adaptive):
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{len(questions)} preguntas en {elapsed:.1f}s "
+            f"({len(questions) / elapsed:.2f} preguntas/s)",
+            file=sys.stderr,
+        )
+        print_path_stats()
+        sys.exit()
+
+    # python -m solved.smartllm.v2 [--stream] [--adaptive] [pregunta]
+    stream = "--stream" in sys.argv
+    question = args[0] if args else DEFAULT
+    usage = []
+    if stream:
+        # Medimos desde la pregunta: incluye las ideas y la crítica
+        start = time.perf_counter()
+        print_stream(
+            smartllm(question, stream=True, usage=usage, adaptive=adaptive), start
+        )
+    else:
+        print(smartllm(question, usage=usage, adaptive=adaptive))
+    print_usage(usage)
+    if adaptive:
+        print_path_stats()
\ No newline at end of file
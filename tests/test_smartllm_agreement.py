@@ -0,0 +1,114 @@
+"""
+Pares de ideas con el resultado esperado del modo adaptativo de
+`solved.smartllm.v2`, para calibrar `AGREEMENT_THRESHOLD`.
+
+```bash
+python -m pytest tests
+```
+"""
+
+import os
+
+import pytest
+
+# `solved.smartllm.v2` crea el cliente de OpenAI al importarse
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from solved.smartllm.v2 import AGREEMENT_THRESHOLD, agreement, extract_answer  # noqa: E402
+
+AGREE = [
+    # Reformulaciones de la misma respuesta
+    [
+        "Step 1: Australia's largest city is Sydney. Step 2: The capital was "
+        "chosen as a compromise between Sydney and Melbourne, so the capital is "
+        "Canberra.",
+        "Australia is a federation whose government sits in a purpose-built "
+        "city. The capital of Australia is Canberra.",
+    ],
+    # El mismo resultado calculado de dos formas
+    [
+        "17 * 3 = 17 + 17 + 17 = 51. So 17 * 3 is 51.",
+        "Split 17 into 10 + 7: 10 * 3 = 30 and 7 * 3 = 21. 30 + 21 = 51. "
+        "Therefore, 17 times 3 equals 51.",
+    ],
+    [
+        "We have 6 apples and buy 3 boxes of 12. 3 * 12 = 36. 36 + 6 = 42. "
+        "The answer is 42.",
+        "Start with 6 apples. Buying 3 boxes of 12 gives 3 * 12 = 36 apples. "
+        "In total we have 42 apples. I hope this helps!",
+    ],
+    [
+        "Botanically, a fruit develops from the flower and contains seeds. "
+        "Tomatoes develop from the flower and contain seeds. So yes, tomatoes "
+        "are fruits. Let me know if you have any other questions!",
+        "A tomato grows from the ovary of a flower. Therefore a tomato is "
+        "botanically a fruit.",
+    ],
+]
+
+CONTRADICT = [
+    [
+        "Step 1: Australia is a country in Oceania. Step 2: Its largest city is "
+        "Sydney, but the capital was chosen as a compromise. Step 3: So the "
+        "capital of Australia is Canberra.",
+        "Step 1: Australia is a country in Oceania. Step 2: Its largest and best "
+        "known city is Sydney, which hosts the government. Step 3: So the capital "
+        "of Australia is Sydney.",
+    ],
+    [
+        "The capital of Australia is Canberra, not Sydney.",
+        "So the capital of Australia is Sydney.",
+    ],
+    [
+        "We have 6 apples and buy 3 boxes of 12. 3 * 12 = 36. 36 + 6 = 42. "
+        "The answer is 42.",
+        "We have 6 apples and buy 3 boxes of 12. 3 * 12 = 38. 38 + 6 = 44. "
+        "The answer is 44.",
+    ],
+    [
+        "Botanically, a fruit develops from the flower and contains seeds. "
+        "Tomatoes develop from the flower and contain seeds. So yes, tomatoes "
+        "are fruits.",
+        "Botanically, a fruit develops from the flower and contains seeds. "
+        "In cooking, tomatoes are used as vegetables. So no, tomatoes are not "
+        "fruits.",
+    ],
+    # Casi el mismo texto y la misma despedida, distinto resultado
+    [
+        "At sea level the pressure is 1 atm. Water boils at 100 C at sea level. "
+        "I hope this helps!",
+        "At sea level the pressure is 1 atm. Water boils at 90 C at sea level. "
+        "I hope this helps!",
+    ],
+]
+
+
+@pytest.mark.parametrize("ideas", AGREE)
+def test_agreeing_ideas_exit_early(ideas):
+    score, _ = agreement(ideas)
+    assert score >= AGREEMENT_THRESHOLD
+
+
+@pytest.mark.parametrize("ideas", CONTRADICT)
+def test_contradicting_ideas_are_critiqued(ideas):
+    score, _ = agreement(ideas)
+    assert score < AGREEMENT_THRESHOLD
+
+
+def test_extract_answer_skips_closing_sentences():
+    answer = extract_answer(
+        "3 * 12 = 36 and 36 + 6 = 42. The answer is 42 apples. "
+        "Let me know if you have any other questions!"
+    )
+    assert answer.numbers == ("42",)
+    assert answer.terms == {"apple"}
+
+
+def test_representative_idea_is_the_most_supported():
+    ideas = [
+        "So the capital of Australia is Sydney.",
+        "So the capital of Australia is Canberra.",
+        "The answer is Canberra.",
+    ]
+    _, best = agreement(ideas)
+    assert best == ideas[1]